@@ -0,0 +1,45 @@
+class AdaptiveScale:
+    def __init__(self, levels=(1.0, 0.75, 0.5, 0.375, 0.25), headroom=0.6, patience=15, smoothing=0.1):
+        # levels: processing scale factors from best quality to cheapest
+        # headroom: step back up once frames take less than this share of the budget
+        # patience: consecutive frames over (or under) budget before changing level
+        self.levels = levels
+        self.headroom = headroom
+        self.patience = patience
+        self.smoothing = smoothing
+        self.index = 0
+        self.average = None
+        self.over = 0
+        self.under = 0
+
+    @property
+    def factor(self):
+        return self.levels[self.index]
+
+    def update(self, frame_time, budget):
+        # Feed the measured time of one frame and the time it may take; returns the new factor
+        if self.average is None:
+            self.average = frame_time
+        else:
+            self.average += self.smoothing * (frame_time - self.average)
+
+        if self.average > budget:
+            self.over += 1
+            self.under = 0
+        elif self.average < budget * self.headroom:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = self.under = 0
+
+        if self.over >= self.patience and self.index < len(self.levels) - 1:
+            self.change(self.index + 1)
+        elif self.under >= self.patience * 2 and self.index > 0:
+            self.change(self.index - 1)
+        return self.factor
+
+    def change(self, index):
+        # Timings from the old level no longer apply
+        self.index = index
+        self.average = None
+        self.over = self.under = 0
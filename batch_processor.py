@@ -0,0 +1,244 @@
+import cv2
+import os
+import glob
+import shutil
+import argparse
+import tempfile
+from multiprocessing import Pool
+from vision_modes import VisionProcessor
+from frame_pipeline import FramePipeline
+from camera_handler import CameraHandler
+from frame_clock import FrameClock
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+
+class FrameSource:
+    def __init__(self, source, start=0, end=None):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.images = None
+        self.capture = None
+        self.camera = None
+        self.fps = 30.0
+
+        if isinstance(source, int) or str(source).isdigit():
+            self.camera = CameraHandler(int(source))
+        elif os.path.isdir(source):
+            self.images = sorted(path for path in glob.glob(os.path.join(source, "*"))
+                                 if path.lower().endswith(IMAGE_EXTENSIONS))
+        elif any(char in source for char in "*?["):
+            self.images = sorted(glob.glob(source))
+        else:
+            self.capture = cv2.VideoCapture(source)
+            if not self.capture.isOpened():
+                raise IOError(f"Cannot open video source: {source}")
+            self.fps = self.capture.get(cv2.CAP_PROP_FPS) or self.fps
+
+    def frame_count(self):
+        # Number of frames in [start, end), None for live cameras
+        if self.images is not None:
+            total = len(self.images)
+        elif self.capture is not None:
+            total = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        else:
+            return None
+        end = total if self.end is None else min(self.end, total)
+        return max(0, end - self.start)
+
+    def __iter__(self):
+        index = self.start
+        if self.capture is not None and self.start:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+        while self.end is None or index < self.end:
+            if self.images is not None:
+                if index >= len(self.images):
+                    break
+                frame = cv2.imread(self.images[index])
+            elif self.capture is not None:
+                ret, frame = self.capture.read()
+                frame = frame if ret else None
+            else:
+                frame = self.camera.get_frame()
+            if frame is None:
+                break
+            yield index, frame
+            index += 1
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+        if self.camera is not None:
+            self.camera.release()
+
+class FrameSink:
+    def __init__(self, output, fps=30.0, codec="mp4v"):
+        self.output = output
+        self.fps = fps
+        self.codec = codec
+        self.writer = None
+        self.frames_written = 0
+        self.image_pattern = None
+
+        if output.lower().endswith(VIDEO_EXTENSIONS):
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        elif "%" in os.path.basename(output):
+            # Explicit pattern such as out/frame_%06d.png
+            self.image_pattern = output
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        else:
+            self.image_pattern = os.path.join(output, "frame_%06d.png")
+            os.makedirs(output, exist_ok=True)
+
+    def write(self, index, frame):
+        if self.image_pattern is not None:
+            cv2.imwrite(self.image_pattern % index, frame)
+        else:
+            if self.writer is None:
+                height, width = frame.shape[:2]
+                fourcc = cv2.VideoWriter_fourcc(*self.codec)
+                self.writer = cv2.VideoWriter(self.output, fourcc, self.fps, (width, height))
+                if not self.writer.isOpened():
+                    raise IOError(f"Cannot open video writer: {self.output}")
+            self.writer.write(frame)
+        self.frames_written += 1
+
+    def release(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+
+def process_stream(source, sink, mode, enable_noise=True, enable_vignette=True,
+                   workers=1, preroll=0):
+    # Run every frame of source through one vision mode into sink, as fast as possible
+    # Files run faster than they were shot; noise refreshes follow the frame index, not the wall clock
+    clock = None if source.camera is not None else FrameClock(source.fps)
+    processor = VisionProcessor(clock=clock)
+    processor.update_settings(enable_noise, enable_vignette)
+    pipeline = FramePipeline(workers) if workers > 1 else None
+    pending = []
+
+    for index, frame in source:
+        if pipeline is None:
+            if clock is not None:
+                clock.seek(index)
+            result = processor.process(frame, mode)
+            if index >= source.start + preroll:
+                sink.write(index, result)
+            continue
+
+        stages = processor.stages(mode)
+        pipeline.submit(frame, stages if clock is None else clock.timed(stages, index))
+        pending.append(index)
+        if pipeline.in_flight >= pipeline.max_in_flight:
+            finished = pending.pop(0)
+            result = pipeline.get()
+            if finished >= source.start + preroll:
+                sink.write(finished, result)
+
+    if pipeline is not None:
+        for finished, result in zip(pending, pipeline.drain()):
+            if finished >= source.start + preroll:
+                sink.write(finished, result)
+        pipeline.shutdown()
+    return sink.frames_written
+
+def process_chunk(job):
+    source_path, output, start, end, preroll, mode, enable_noise, enable_vignette, fps, codec = job
+
+    # Warm up stateful effects such as the phosphor trail on frames before the chunk
+    warm_start = max(0, start - preroll)
+    source = FrameSource(source_path, warm_start, end)
+    sink = FrameSink(output, fps, codec)
+    try:
+        return process_stream(source, sink, mode, enable_noise, enable_vignette,
+                              preroll=start - warm_start)
+    finally:
+        source.release()
+        sink.release()
+
+def concatenate_videos(chunks, output, fps, codec):
+    sink = FrameSink(output, fps, codec)
+    index = 0
+    try:
+        for chunk in chunks:
+            capture = cv2.VideoCapture(chunk)
+            while True:
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                sink.write(index, frame)
+                index += 1
+            capture.release()
+    finally:
+        sink.release()
+    return index
+
+def process_file(source_path, output, mode, enable_noise=True, enable_vignette=True,
+                 jobs=1, workers=1, start=0, end=None, codec="mp4v", preroll=10):
+    source = FrameSource(source_path, start, end)
+    total = source.frame_count()
+    fps = source.fps
+
+    # Live cameras and short inputs run in this process
+    if jobs <= 1 or total is None or total < jobs * 2:
+        sink = FrameSink(output, fps, codec)
+        try:
+            return process_stream(source, sink, mode, enable_noise, enable_vignette, workers)
+        finally:
+            source.release()
+            sink.release()
+    source.release()
+
+    # Split long inputs into contiguous chunks, one per process
+    chunk_size = (total + jobs - 1) // jobs
+    bounds = [(begin, min(begin + chunk_size, start + total))
+              for begin in range(start, start + total, chunk_size)]
+    writes_video = output.lower().endswith(VIDEO_EXTENSIONS)
+    temp_dir = tempfile.mkdtemp(prefix="vision_chunks_") if writes_video else None
+
+    chunk_jobs = []
+    for number, (begin, finish) in enumerate(bounds):
+        chunk_output = os.path.join(temp_dir, f"chunk_{number:04d}.avi") if writes_video else output
+        chunk_jobs.append((source_path, chunk_output, begin, finish, preroll, mode,
+                           enable_noise, enable_vignette, fps, "MJPG" if writes_video else codec))
+
+    try:
+        with Pool(min(jobs, len(chunk_jobs))) as pool:
+            written = sum(pool.map(process_chunk, chunk_jobs))
+        if writes_video:
+            written = concatenate_videos([job[1] for job in chunk_jobs], output, fps, codec)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return written
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Apply a vision mode to recorded footage without a GUI")
+    parser.add_argument("input", help="video file, image directory, glob pattern or camera id")
+    parser.add_argument("output", help="video file (.mp4/.avi/...), image directory or %%d pattern")
+    parser.add_argument("--mode", default="night_high",
+                        help="vision mode, e.g. normal, night_high, thermal_ironbow")
+    parser.add_argument("--no-noise", action="store_true", help="disable noise")
+    parser.add_argument("--no-vignette", action="store_true", help="disable vignette")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="split long inputs into chunks processed by this many processes")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker threads per process")
+    parser.add_argument("--start", type=int, default=0, help="first frame to process")
+    parser.add_argument("--end", type=int, default=None, help="stop before this frame")
+    parser.add_argument("--codec", default="mp4v", help="FourCC of the output video")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    written = process_file(args.input, args.output, args.mode,
+                           enable_noise=not args.no_noise,
+                           enable_vignette=not args.no_vignette,
+                           jobs=args.jobs, workers=args.workers,
+                           start=args.start, end=args.end, codec=args.codec)
+    print(f"Wrote {written} frames to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import cv2
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+from time import perf_counter
+from vision_modes import VisionProcessor, parse_processing_scales
+from gui_controller import GUIController
+from bloom import BLOOM_METHODS, glow
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+RESOLUTIONS = {
+    "480p": (640, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160)
+}
+
+MODES = [
+    "normal",
+    "night_high",
+    "night_low",
+    "night_green",
+    "night_blue",
+    "thermal_hot_white",
+    "thermal_hot_black",
+    "thermal_rainbow",
+    "thermal_ironbow",
+    "thermal_plasma"
+]
+
+def synthetic_frames(width, height, count=8, seed=0):
+    # Deterministic scenes with gradients, moving shapes and sensor-like noise
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(30, 200, width, dtype=np.float32)[np.newaxis, :]
+    background = np.repeat(gradient, height, axis=0).astype(np.uint8)
+    frames = []
+    for index in range(count):
+        frame = cv2.merge([background, np.flipud(background), background // 2])
+        offset = index * width // (count * 4)
+        for shape in range(6):
+            center = (int((shape + 1) * width / 7) + offset, int(height * (0.3 + 0.1 * (shape % 4))))
+            radius = max(4, height // (8 + shape))
+            color = tuple(int(value) for value in rng.integers(40, 255, 3))
+            cv2.circle(frame, center, radius, color, -1)
+        noise = rng.integers(0, 16, frame.shape, dtype=np.uint8)
+        frames.append(cv2.add(frame, noise))
+    return frames
+
+def summarize(samples):
+    values = np.array(samples) * 1000.0
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99))
+    }
+
+def run_frame(processor, gui, frame, mode, stage_times):
+    for stage in processor.stages(mode):
+        start = perf_counter()
+        frame = stage.func(frame)
+        stage_times.setdefault(stage.name, []).append(perf_counter() - start)
+    if gui is not None:
+        start = perf_counter()
+        gui.display_frame(frame)
+        stage_times.setdefault("display", []).append(perf_counter() - start)
+    return frame
+
+def benchmark_case(mode, resolution, enable_noise=True, enable_vignette=True,
+                   frames=60, warmup=5, include_display=True, seed=0,
+                   processing_scales=None, bloom_method="pyramid", luminance_bloom=True):
+    width, height = RESOLUTIONS[resolution]
+    inputs = synthetic_frames(width, height, seed=seed)
+
+    processor = VisionProcessor(seed=seed, bloom_method=bloom_method, luminance_bloom=luminance_bloom)
+    processor.processing_scales = dict(processing_scales or {})
+    processor.update_settings(enable_noise, enable_vignette)
+    gui = None
+    if include_display:
+        gui = GUIController(headless=True, rng=np.random.default_rng(seed))
+        gui.current_mode = mode
+        gui.enable_noise = enable_noise
+        gui.enable_vignette = enable_vignette
+
+    # Warm up caches and allocators before measuring
+    for index in range(warmup):
+        run_frame(processor, gui, inputs[index % len(inputs)].copy(), mode, {})
+
+    stage_times = {}
+    latencies = []
+    for index in range(frames):
+        frame = inputs[index % len(inputs)].copy()
+        start = perf_counter()
+        run_frame(processor, gui, frame, mode, stage_times)
+        latencies.append(perf_counter() - start)
+
+    # Measure peak allocations separately so tracing does not skew the timings
+    tracemalloc.start()
+    for index in range(min(frames, 5)):
+        run_frame(processor, gui, inputs[index % len(inputs)].copy(), mode, {})
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    total = sum(latencies)
+    return {
+        "mode": mode,
+        "resolution": resolution,
+        "width": width,
+        "height": height,
+        "noise": enable_noise,
+        "vignette": enable_vignette,
+        "processing_scales": dict(processing_scales or {}),
+        "bloom": bloom_method,
+        "luminance_bloom": luminance_bloom,
+        "frames": frames,
+        "fps": frames / total if total > 0 else float("inf"),
+        "latency": summarize(latencies),
+        "stages": {name: summarize(samples) for name, samples in stage_times.items()},
+        "peak_memory_mb": peak / (1024 * 1024)
+    }
+
+def bloom_sweep(resolution, sigmas=(5, 10, 20, 40), channels=(1, 3), repeats=5, seed=0):
+    # Glow cost and accuracy against the exact Gaussian for every method and radius
+    width, height = RESOLUTIONS[resolution]
+    frame = synthetic_frames(width, height, count=1, seed=seed)[0]
+    images = {1: cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), 3: frame}
+    rows = []
+    for count in channels:
+        image = images[count]
+        for sigma in sigmas:
+            reference = glow(image, sigma, "gaussian")
+            for method in BLOOM_METHODS:
+                result = glow(image, sigma, method)
+                start = perf_counter()
+                for _ in range(repeats):
+                    glow(image, sigma, method)
+                rows.append({
+                    "resolution": resolution,
+                    "channels": count,
+                    "sigma": sigma,
+                    "method": method,
+                    "ms": (perf_counter() - start) / repeats * 1000.0,
+                    "psnr_db": float(cv2.PSNR(reference, result))
+                })
+    return rows
+
+def case_key(case):
+    # Every setting that changes the work done; baselines written before a setting existed never match
+    scales = case.get("processing_scales")
+    return (case["mode"], case["resolution"], case["noise"], case["vignette"],
+            None if scales is None else tuple(sorted(scales.items())),
+            case.get("bloom"), case.get("luminance_bloom"))
+
+def compare(results, baseline, threshold):
+    # Report cases whose throughput fell by more than threshold
+    previous = {case_key(case): case for case in baseline["cases"]}
+    regressions = []
+    unmatched = []
+    for case in results["cases"]:
+        old = previous.get(case_key(case))
+        if old is None:
+            unmatched.append(case_key(case))
+            continue
+        change = case["fps"] / old["fps"] - 1.0
+        if change < -threshold:
+            regressions.append((case_key(case), old["fps"], case["fps"], change))
+    return regressions, unmatched
+
+def toggle_values(choice):
+    return {"on": [True], "off": [False], "both": [True, False]}[choice]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark vision modes on synthetic frames")
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS),
+                        default=["480p", "720p", "1080p", "4k"])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--frames", type=int, default=60, help="measured frames per case")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured frames per case")
+    parser.add_argument("--noise", choices=["on", "off", "both"], default="both")
+    parser.add_argument("--vignette", choices=["on", "off", "both"], default="on")
+    parser.add_argument("--no-display", action="store_true",
+                        help="skip the headless GUIController.display_frame stage")
+    parser.add_argument("--processing-scale", action="append", metavar="MODE=SCALE",
+                        help="run a mode or mode family at reduced resolution, e.g. thermal=0.5")
+    parser.add_argument("--bloom", choices=BLOOM_METHODS, default="pyramid",
+                        help="glow implementation used by the vision modes")
+    parser.add_argument("--color-bloom", action="store_true",
+                        help="dilate and bloom thermal images after colormapping")
+    parser.add_argument("--bloom-sweep", action="store_true",
+                        help="also time every bloom method over a range of radii")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic frames")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="allowed relative FPS drop before a case counts as a regression")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    scales = parse_processing_scales(args.processing_scale)
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_threads": cv2.getNumThreads(),
+        "cases": []
+    }
+
+    for resolution in args.resolutions:
+        for mode in args.modes:
+            for enable_noise in toggle_values(args.noise):
+                for enable_vignette in toggle_values(args.vignette):
+                    case = benchmark_case(mode, resolution, enable_noise, enable_vignette,
+                                          args.frames, args.warmup, not args.no_display, args.seed,
+                                          scales, args.bloom,
+                                          not args.color_bloom)
+                    results["cases"].append(case)
+                    latency = case["latency"]
+                    print(f"{resolution:>5} {mode:<18} noise={'on ' if enable_noise else 'off'} "
+                          f"vignette={'on ' if enable_vignette else 'off'} "
+                          f"{case['fps']:8.1f} fps  p50 {latency['p50_ms']:7.2f} ms  "
+                          f"p95 {latency['p95_ms']:7.2f} ms  p99 {latency['p99_ms']:7.2f} ms  "
+                          f"peak {case['peak_memory_mb']:7.1f} MB")
+
+    if args.bloom_sweep:
+        results["bloom_sweep"] = []
+        for resolution in args.resolutions:
+            for row in bloom_sweep(resolution, seed=args.seed):
+                results["bloom_sweep"].append(row)
+                print(f"{resolution:>5} bloom {row['method']:<8} {row['channels']}ch sigma {row['sigma']:>3} "
+                      f"{row['ms']:8.2f} ms  {row['psnr_db']:6.1f} dB")
+
+    if resource is not None:
+        results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        regressions, unmatched = compare(results, baseline, args.threshold)
+        for key in unmatched:
+            print(f"NO BASELINE {key}: the baseline has no case with the same settings")
+        for key, old_fps, new_fps, change in regressions:
+            print(f"REGRESSION {key}: {old_fps:.1f} -> {new_fps:.1f} fps ({change:+.1%})")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+
+# gaussian: exact cv2.GaussianBlur, cost grows with sigma
+# pyramid: blur a downscaled copy and upscale it, cost almost independent of sigma
+# box: cv2.stackBlur, a stacked box approximation with constant cost per pixel
+BLOOM_METHODS = ("gaussian", "pyramid", "box")
+
+def pyramid_levels(sigma, min_sigma=2.0):
+    # Halvings that still leave at least min_sigma of blur on the small image
+    if sigma <= min_sigma:
+        return 0
+    return int(np.floor(np.log2(sigma / min_sigma)))
+
+def pyramid_size(shape, sigma):
+    factor = 1 << pyramid_levels(sigma)
+    height, width = shape[:2]
+    return max(1, int(round(height / factor))), max(1, int(round(width / factor)))
+
+def pyramid_blur(image, sigma, dst=None, small=None):
+    levels = pyramid_levels(sigma)
+    if levels == 0:
+        return cv2.GaussianBlur(image, (0, 0), sigma, dst=dst)
+    factor = 1 << levels
+    height, width = image.shape[:2]
+    small_height, small_width = pyramid_size(image.shape, sigma)
+    small = cv2.resize(image, (small_width, small_height), dst=small, interpolation=cv2.INTER_AREA)
+
+    # The area prefilter and the linear upscale widen the blur themselves; take that out of the small Gaussian
+    small_sigma = np.sqrt(max(sigma * sigma - 0.25 * factor * factor, 0.25)) / factor
+    cv2.GaussianBlur(small, (0, 0), small_sigma, dst=small)
+    return cv2.resize(small, (width, height), dst=dst, interpolation=cv2.INTER_LINEAR)
+
+def box_blur(image, sigma, dst=None):
+    # Kernel width chosen to best match a Gaussian of the same sigma
+    size = 2 * int(round(2.5 * sigma)) + 1
+    return cv2.stackBlur(image, (size, size), dst=dst)
+
+def glow(image, sigma, method="pyramid", dst=None, small=None):
+    if method == "pyramid":
+        return pyramid_blur(image, sigma, dst, small)
+    if method == "box":
+        return box_blur(image, sigma, dst)
+    if method == "gaussian":
+        return cv2.GaussianBlur(image, (0, 0), sigma, dst=dst)
+    raise ValueError(f"Unknown bloom method: {method}")
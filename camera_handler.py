@@ -1,49 +1,210 @@
-import cv2
-
-class CameraHandler:
-    def __init__(self, camera_id=0):
-        self.camera = cv2.VideoCapture(camera_id)
-        self.set_resolution(640, 480)  # Default resolution
-        self.zoom_factor = 1.0
-        self.zoom_step = 0.1
-        self.min_zoom = 1.0
-        self.max_zoom = 3.0
-        
-    def set_resolution(self, width, height):
-        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        
-    def apply_zoom(self, frame):
-        # Return original frame if no zoom
-        if self.zoom_factor == 1.0:
-            return frame
-            
-        # Calculate zoom window dimensions
-        height, width = frame.shape[:2]
-        zoom_width = int(width / self.zoom_factor)
-        zoom_height = int(height / self.zoom_factor)
-        
-        # Calculate center crop coordinates
-        x1 = (width - zoom_width) // 2
-        y1 = (height - zoom_height) // 2
-        x2 = x1 + zoom_width
-        y2 = y1 + zoom_height
-        
-        # Crop and resize to original dimensions
-        cropped = frame[y1:y2, x1:x2]
-        return cv2.resize(cropped, (width, height))
-        
-    def zoom_in(self):
-        self.zoom_factor = min(self.zoom_factor + self.zoom_step, self.max_zoom)
-        
-    def zoom_out(self):
-        self.zoom_factor = max(self.zoom_factor - self.zoom_step, self.min_zoom)
-        
-    def get_frame(self):
-        ret, frame = self.camera.read()
-        if ret:
-            return self.apply_zoom(frame)
-        return None
-        
-    def release(self):
-        self.camera.release() 
\ No newline at end of file
+import cv2
+from threading import Thread
+from frame_buffer import FrameRingBuffer
+from profiler import profiler
+
+class CameraHandler:
+    # Requested when the camera opens; the device may settle on another size
+    default_resolution = (640, 480)
+
+    def __init__(self, camera_id=0, threaded=False, buffer_size=4, buffer_policy="latest",
+                 zoom_mode="resize", hardware_zoom=False):
+        self.camera = cv2.VideoCapture(camera_id)
+        self.resolution = self.set_resolution(*self.default_resolution)
+        self.zoom_factor = 1.0
+        self.target_zoom = 1.0
+        self.zoom_smoothing = 0.35  # Share of the remaining zoom change applied per frame
+        self.zoom_step = 0.1
+        self.min_zoom = 1.0
+        self.max_zoom = 3.0
+        # "resize" scales the crop back to full size here, "roi" hands the crop view downstream
+        # and finish_zoom upscales the processed frame once
+        self.zoom_mode = zoom_mode
+        self.roi_step = 16  # ROI widths are rounded to this many pixels to limit distinct sizes
+        self.zoom_buffer = None
+        self.output_buffer = None
+        self.output_size = None
+        # Last captured frame before the software zoom; valid until the next get_frame
+        self.raw_frame = None
+        # Zoom ratio the driver applies itself via CAP_PROP_ZOOM, None when unsupported
+        self.hardware_zoom_base = self.negotiate_hardware_zoom() if hardware_zoom else None
+        self.hardware_ratio = 1.0
+        self.threaded = threaded
+        self.frame_buffer = FrameRingBuffer(buffer_size, buffer_policy)
+        self.capture_thread = None
+        self.running = False
+        if threaded:
+            self.start_capture()
+
+    def set_resolution(self, width, height):
+        # Returns the resolution the device actually accepted
+        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        actual_width = int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH)) or width
+        actual_height = int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT)) or height
+        self.resolution = (actual_width, actual_height)
+        return self.resolution
+
+    def negotiate_hardware_zoom(self):
+        # Drivers that expose CAP_PROP_ZOOM crop on the device; its units are device specific
+        base = self.camera.get(cv2.CAP_PROP_ZOOM)
+        if base <= 0 or not self.camera.set(cv2.CAP_PROP_ZOOM, base):
+            return None
+        return base
+
+    def update_hardware_zoom(self):
+        # Ask the device for the zoom and crop in software only for what it could not do
+        requested = self.hardware_zoom_base * self.zoom_factor
+        if self.camera.set(cv2.CAP_PROP_ZOOM, requested):
+            actual = self.camera.get(cv2.CAP_PROP_ZOOM)
+            self.hardware_ratio = max(1.0, min(actual / self.hardware_zoom_base, self.zoom_factor))
+        else:
+            self.hardware_ratio = 1.0
+
+    def update_zoom(self):
+        # Ease toward the requested zoom instead of jumping a whole step
+        previous = self.zoom_factor
+        change = self.target_zoom - self.zoom_factor
+        if abs(change) < 0.005:
+            self.zoom_factor = self.target_zoom
+        else:
+            self.zoom_factor += change * self.zoom_smoothing
+        if self.hardware_zoom_base is not None and self.zoom_factor != previous:
+            self.update_hardware_zoom()
+
+    def zoom_window(self, width, height, zoom):
+        zoom_width = int(width / zoom)
+        if self.zoom_mode == "roi":
+            # Fewer distinct ROI sizes keep per-resolution caches downstream warm
+            zoom_width = max(self.roi_step, zoom_width // self.roi_step * self.roi_step)
+        zoom_height = min(height, int(round(zoom_width * height / width)))
+        x1 = (width - zoom_width) // 2
+        y1 = (height - zoom_height) // 2
+        return x1, y1, x1 + zoom_width, y1 + zoom_height
+
+    def upscale(self, image, size, dst=None):
+        # Cubic only once the magnification is large enough to show; dst is reused when it fits
+        interpolation = cv2.INTER_CUBIC if size[0] >= 2 * image.shape[1] else cv2.INTER_LINEAR
+        return cv2.resize(image, size, dst=dst, interpolation=interpolation)
+
+    def apply_zoom(self, frame):
+        height, width = frame.shape[:2]
+        self.output_size = (width, height)
+
+        # Return original frame if no zoom is left after the device zoom
+        zoom = self.zoom_factor / self.hardware_ratio
+        if zoom <= 1.0:
+            return frame
+
+        # Center crop as a view of the captured frame
+        x1, y1, x2, y2 = self.zoom_window(width, height, zoom)
+        cropped = frame[y1:y2, x1:x2]
+        if self.zoom_mode == "roi":
+            return self.snap_roi(cropped, width, height)
+        self.zoom_buffer = self.upscale(cropped, (width, height), self.zoom_buffer)
+        return self.zoom_buffer
+
+    def snap_roi(self, cropped, width, height):
+        # While easing, the window follows the eased zoom but is resized to the ROI size of the
+        # target zoom, so the effects see one new size per zoom change instead of one per frame
+        target = self.target_zoom / self.hardware_ratio
+        if target <= 1.0:
+            size = (width, height)
+        else:
+            x1, y1, x2, y2 = self.zoom_window(width, height, target)
+            size = (x2 - x1, y2 - y1)
+        if (cropped.shape[1], cropped.shape[0]) == size:
+            return cropped
+        self.zoom_buffer = cv2.resize(cropped, size, dst=self.zoom_buffer, interpolation=cv2.INTER_LINEAR)
+        return self.zoom_buffer
+
+    def finish_zoom(self, frame):
+        # Bring a frame processed at ROI size back to the capture size
+        if self.output_size is None or (frame.shape[1], frame.shape[0]) == self.output_size:
+            return frame
+        with profiler.stage("camera.upscale"):
+            self.output_buffer = self.upscale(frame, self.output_size, self.output_buffer)
+        return self.output_buffer
+
+    @property
+    def reuses_buffers(self):
+        # Frames from get_frame are overwritten by later calls and must be copied to be kept
+        return self.threaded or self.zoom_buffer is not None
+
+    def zoom_in(self):
+        self.target_zoom = min(self.target_zoom + self.zoom_step, self.max_zoom)
+
+    def zoom_out(self):
+        self.target_zoom = max(self.target_zoom - self.zoom_step, self.min_zoom)
+
+    def start_capture(self):
+        if self.capture_thread is not None:
+            return
+        self.running = True
+        self.capture_thread = Thread(target=self.capture_loop, name="camera-capture", daemon=True)
+        self.capture_thread.start()
+
+    def capture_loop(self):
+        buffer = self.frame_buffer
+        shape = None
+        while self.running:
+            if shape is None:
+                # First frame tells us the resolution to preallocate for
+                ret, frame = self.camera.read()
+                if ret:
+                    shape = frame.shape
+                    buffer.write(frame)
+            else:
+                index = buffer.acquire(shape)
+                if index is None:
+                    break
+                slot = buffer.slots[index]
+                ret, frame = self.camera.read(slot)
+                if ret and frame is slot:
+                    buffer.commit(index)
+                else:
+                    buffer.cancel(index)
+                    if ret:
+                        # Resolution changed, the buffer reallocates on this write
+                        shape = frame.shape
+                        buffer.write(frame)
+            if not ret:
+                break
+        buffer.close()
+
+    @property
+    def frame_shape(self):
+        width, height = self.resolution
+        return (height, width, 3)
+
+    def get_frame(self, dst=None):
+        # dst: array the device reads into when capturing on this thread, e.g. a shared memory slot
+        with profiler.stage("camera.capture"):
+            if self.threaded:
+                # Frame lives in the ring buffer until the next call
+                frame = self.frame_buffer.read()
+            else:
+                ret, frame = self.camera.read() if dst is None else self.camera.read(dst)
+                frame = frame if ret else None
+        self.raw_frame = frame
+        if frame is None:
+            return None
+        with profiler.stage("camera.zoom"):
+            self.update_zoom()
+            return self.apply_zoom(frame)
+
+    @property
+    def dropped_frames(self):
+        return self.frame_buffer.dropped_frames
+
+    @property
+    def queue_depth(self):
+        return self.frame_buffer.queue_depth
+
+    def release(self):
+        if self.capture_thread is not None:
+            self.running = False
+            self.frame_buffer.close()
+            self.capture_thread.join(timeout=1.0)
+            self.capture_thread = None
+        self.camera.release()
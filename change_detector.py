@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+
+class ChangeDetector:
+    def __init__(self, threshold=3.0, size=(64, 36), samples=4):
+        # threshold: largest change in the mean brightness of any block (0-255) still treated as static
+        # size: thumbnail the frame is reduced to; each thumbnail pixel is the mean of one block
+        # samples: pixels averaged per block along each axis; reading every pixel costs 20x more
+        self.threshold = threshold
+        self.size = size
+        self.grid = (size[0] * samples, size[1] * samples)
+        self.reference = None
+        self.sampled = None
+        self.thumbnail = None
+        self.frames = 0
+        self.unchanged = 0
+
+    def save(self):
+        # The reference is updated in place, so it is copied
+        return None if self.reference is None else self.reference.copy(), self.frames, self.unchanged
+
+    def restore(self, state):
+        self.reference, self.frames, self.unchanged = state
+
+    def changed(self, image):
+        # The reference only moves on a detected change, so slow drift still adds up to one
+        self.frames += 1
+        self.sampled = cv2.resize(image, self.grid, dst=self.sampled, interpolation=cv2.INTER_NEAREST)
+        self.thumbnail = cv2.resize(self.sampled, self.size, dst=self.thumbnail, interpolation=cv2.INTER_AREA)
+        reference = self.reference
+        if reference is None or reference.shape != self.thumbnail.shape:
+            self.reference = self.thumbnail.copy()
+            return True
+        difference = cv2.absdiff(self.thumbnail, reference)
+        if float(np.max(difference)) > self.threshold:
+            np.copyto(reference, self.thumbnail)
+            return True
+        self.unchanged += 1
+        return False
+
+    @property
+    def reuse_ratio(self):
+        return self.unchanged / self.frames if self.frames else 0.0
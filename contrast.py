@@ -0,0 +1,21 @@
+import cv2
+from threading import local
+
+class ContrastEnhancer:
+    def __init__(self, clip_limit=3.0, tile_grid=(8, 8)):
+        self.clip_limit = clip_limit
+        self.tile_grid = tile_grid
+        self.local = local()
+
+    def get_clahe(self):
+        # CLAHE objects keep internal buffers, so each thread gets its own persistent one
+        clahe = getattr(self.local, "clahe", None)
+        if clahe is None:
+            clahe = cv2.createCLAHE(clipLimit=self.clip_limit, tileGridSize=self.tile_grid)
+            self.local.clahe = clahe
+        return clahe
+
+    def apply(self, gray, dst=None):
+        if dst is None:
+            return self.get_clahe().apply(gray)
+        return self.get_clahe().apply(gray, dst=dst)
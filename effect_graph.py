@@ -0,0 +1,550 @@
+import cv2
+import numpy as np
+from time import time
+from collections import OrderedDict
+from threading import local, Event
+from frame_pipeline import PipelineStage
+from mask_cache import (build_vignette_mask, build_circular_mask, build_fade_spans, apply_mask,
+                        circular_mask_box)
+from noise_bank import add_noise
+from bloom import glow, pyramid_size
+from profiler import profiler
+
+class Frame:
+    # State of one frame while it moves through a compiled plan
+    def __init__(self, image, plan):
+        self.input = image
+        self.image = image
+        self.plan = plan
+        self.settings = plan.settings
+        # Stages run at plan.scale; pixel-sized parameters are multiplied by it
+        self.scale = plan.scale
+        self.shape = image.shape
+        if self.scale < 1.0:
+            height, width = image.shape[:2]
+            self.shape = (max(1, int(round(height * self.scale))),
+                          max(1, int(round(width * self.scale)))) + image.shape[2:]
+        self.data = {}
+        self.stage_index = 0
+        self.scratch = set()
+        # Change detection: the cached prefix this frame fills or reuses, and the reused image
+        self.fill = None
+        self.reuse = None
+        self.reused = None
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        # Scratch array owned by the current stage, reused on later frames of this thread
+        array = self.plan.buffer((self.stage_index, name), shape, dtype)
+        self.scratch.add(id(array))
+        return array
+
+    def scaled(self, pixels):
+        return max(1, int(round(pixels * self.scale)))
+
+    def target(self, image, name="out"):
+        # Where a stage may write its result; the caller's input frame and cached images are never modified
+        if image is not self.input and image is not self.reused:
+            return image
+        return self.buffer(name, image.shape, image.dtype)
+
+class Stage:
+    name = "stage"
+    # Stages that keep state between frames run in frame order under a FramePipeline
+    ordered = False
+    # Settings flag that has to be on for the stage to be compiled into a plan
+    setting = None
+    # Output changes from frame to frame even for the same input (noise, trails)
+    animated = False
+
+    def enabled(self, settings):
+        return self.setting is None or settings.get(self.setting, True)
+
+    def lut(self):
+        # Per-pixel stages return a 256-entry uint8 table so neighbours can be fused
+        return None
+
+    def fold_lut(self, lut):
+        # A stage that can absorb a preceding table returns the fused replacement
+        return None
+
+    def fold_next(self, stage):
+        # A stage that can absorb the stage after it returns the fused replacement
+        return None
+
+    def update(self, frame):
+        # Per-frame state such as noise refreshes; runs in frame order before any processing
+        pass
+
+    def save(self):
+        # State carried over from earlier frames, for restore() after a frame that should leave no trace
+        return None
+
+    def restore(self, state):
+        pass
+
+    def run(self, image, frame):
+        return image
+
+class Grayscale(Stage):
+    name = "grayscale"
+
+    def run(self, image, frame):
+        if image.ndim == 2:
+            return image
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=frame.buffer("gray", image.shape[:2]))
+
+class LookupTable(Stage):
+    name = "lut"
+
+    def __init__(self, table, name=None):
+        self.table = table
+        if name is not None:
+            self.name = name
+
+    def lut(self):
+        return self.table
+
+    def run(self, image, frame):
+        return cv2.LUT(image, self.table, dst=frame.target(image))
+
+class Brightness(LookupTable):
+    name = "brightness"
+
+    def __init__(self, multiplier):
+        # Same rounding and saturation as cv2.multiply by a scalar
+        table = np.clip(np.round(np.arange(256) * multiplier), 0, 255).astype(np.uint8)
+        LookupTable.__init__(self, table)
+        self.multiplier = multiplier
+
+class Contrast(Stage):
+    name = "clahe"
+
+    def __init__(self, enhancer, circle=None):
+        # circle: (margin, fade_width) of a circular mask applied later while the vignette is on;
+        # only the square around the pixels it keeps is equalized
+        self.enhancer = enhancer
+        self.circle = circle
+
+    def run(self, image, frame):
+        if self.circle is None or not frame.settings.get("enable_vignette", True):
+            return self.enhancer.apply(image, dst=frame.buffer("luma", image.shape))
+        out = frame.target(image)
+        if out is not image:
+            np.copyto(out, image)
+        margin, fade_width = self.circle
+        x1, y1, x2, y2 = circular_mask_box(image.shape[0], image.shape[1],
+                                           frame.scaled(margin), frame.scaled(fade_width))
+        visible = out[y1:y2, x1:x2]
+        self.enhancer.apply(image[y1:y2, x1:x2], dst=visible)
+        return out
+
+class Noise(Stage):
+    name = "noise"
+    setting = "enable_noise"
+    animated = True
+
+    def __init__(self, bank, interval=0.03, clock=None):
+        # The pattern is refreshed every interval seconds and shared by the frames in between
+        # clock: returns the current time in seconds; wall time unless a replay supplies its own
+        self.bank = bank
+        self.interval = interval
+        self.clock = clock or time
+        self.pattern = None
+        self.last_update = 0
+
+    def update(self, frame):
+        shape = frame.shape[:2]
+        current_time = self.clock()
+        if (current_time - self.last_update > self.interval
+                or self.pattern is None or self.pattern[0].shape != shape):
+            with profiler.stage(frame.plan.prefix + ".noise_refresh"):
+                self.pattern = self.bank.sample(shape)
+            self.last_update = current_time
+        frame.data[self] = self.pattern
+
+    def save(self):
+        return self.pattern, self.last_update, self.bank.save()
+
+    def restore(self, state):
+        self.pattern, self.last_update, bank = state
+        self.bank.restore(bank)
+
+    def run(self, image, frame):
+        return add_noise(image, frame.data[self], dst=frame.target(image))
+
+class PhosphorTrail(Stage):
+    name = "trail"
+    ordered = True
+    animated = True
+
+    def __init__(self, current_weight=0.85, previous_weight=0.15):
+        self.current_weight = current_weight
+        self.previous_weight = previous_weight
+        self.previous = None
+
+    def save(self):
+        # Blended into in place, so it is copied
+        return None if self.previous is None else self.previous.copy()
+
+    def restore(self, state):
+        self.previous = state
+
+    def run(self, image, frame):
+        out = frame.target(image)
+        previous = self.previous
+        if previous is not None and previous.shape == image.shape:
+            cv2.addWeighted(image, self.current_weight, previous, self.previous_weight, 0, dst=out)
+            np.copyto(previous, out)
+        else:
+            if out is not image:
+                np.copyto(out, image)
+            self.previous = out.copy()
+        return out
+
+class Vignette(Stage):
+    name = "vignette"
+
+    def __init__(self, strength, mask_cache):
+        self.strength = strength
+        self.mask_cache = mask_cache
+
+    def run(self, image, frame):
+        mask = self.mask_cache.get(image.shape, "vignette", build_vignette_mask, self.strength)
+        return apply_mask(image, mask, dst=frame.target(image))
+
+class CircularMask(Stage):
+    name = "mask"
+    setting = "enable_vignette"
+
+    def __init__(self, margin, fade_width, mask_cache):
+        self.margin = margin
+        self.fade_width = fade_width
+        self.mask_cache = mask_cache
+
+    def geometry(self, shape, frame):
+        margin, fade_width = frame.scaled(self.margin), frame.scaled(self.fade_width)
+        mask = self.mask_cache.get(shape, "circular", build_circular_mask, margin, fade_width)
+        spans = self.mask_cache.get(shape[:2], "circular_spans", build_fade_spans, margin, fade_width)
+        return mask, spans
+
+    def run(self, image, frame):
+        # Hidden columns are cleared and opaque ones kept; only the fade ring is multiplied
+        mask, spans = self.geometry(image.shape, frame)
+        out = frame.target(image)
+        for top, bottom, left, right, inner_left, inner_right in spans:
+            rows = out[top:bottom]
+            rows[:, :left] = 0
+            rows[:, right:] = 0
+            if out is not image:
+                rows[:, inner_left:inner_right] = image[top:bottom, inner_left:inner_right]
+            for start, end in ((left, inner_left), (inner_right, right)):
+                if start < end:
+                    apply_mask(image[top:bottom, start:end], mask[top:bottom, start:end],
+                               dst=rows[:, start:end])
+        return out
+
+class Blur(Stage):
+    name = "blur"
+
+    def __init__(self, ksize=5):
+        self.ksize = ksize
+
+    def run(self, image, frame):
+        return cv2.GaussianBlur(image, (self.ksize, self.ksize), 0,
+                                dst=frame.buffer("blur", image.shape))
+
+class Bloom(Stage):
+    name = "bloom"
+
+    def __init__(self, sigma, image_weight, blur_weight, method="pyramid"):
+        # method: one of bloom.BLOOM_METHODS
+        self.sigma = sigma
+        self.image_weight = image_weight
+        self.blur_weight = blur_weight
+        self.method = method
+
+    def run(self, image, frame):
+        sigma = self.sigma * frame.scale
+        small = None
+        if self.method == "pyramid":
+            small = frame.buffer("small", pyramid_size(image.shape, sigma) + image.shape[2:])
+        blur = glow(image, sigma, self.method, frame.buffer("blur", image.shape), small)
+        return cv2.addWeighted(image, self.image_weight, blur, self.blur_weight, 0,
+                               dst=frame.target(image))
+
+class ScanLines(Stage):
+    name = "scan_lines"
+
+    def __init__(self, amount=20):
+        self.amount = amount
+
+    def run(self, image, frame):
+        out = frame.target(image)
+        if out is not image:
+            np.copyto(out, image)
+        even_rows = out[::2]
+        cv2.subtract(even_rows, (self.amount,) * 4, dst=even_rows)
+        return out
+
+class Tint(Stage):
+    name = "tint"
+
+    def __init__(self, channel=1):
+        # Places the plane in one BGR channel; the result is a new image handed to the caller
+        self.channel = channel
+
+    def run(self, image, frame):
+        zeros = frame.buffer("zeros", image.shape)
+        planes = [zeros, zeros, zeros]
+        planes[self.channel] = image
+        return cv2.merge(planes)
+
+class Colormap(Stage):
+    name = "colormap"
+
+    def __init__(self, colormap=cv2.COLORMAP_HOT, table=None):
+        # table: optional 256x1 BGR palette used instead of a built-in colormap;
+        # built-in colormaps are expanded to the same 256-entry table once
+        self.colormap = colormap
+        if table is None:
+            table = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), colormap)
+        self.table = table
+
+    def fold_lut(self, lut):
+        return Colormap(self.colormap, np.ascontiguousarray(self.table[lut]))
+
+    def fold_next(self, stage):
+        if isinstance(stage, CircularMask) and type(self) is Colormap:
+            return MaskedColormap(self.colormap, self.table, stage)
+        return None
+
+    def run(self, image, frame):
+        return cv2.applyColorMap(image, self.table)
+
+class MaskedColormap(Colormap):
+    # Colormap and circular mask in one pass over the luminance plane: only visible columns are
+    # looked up and only the fade ring is multiplied
+    def __init__(self, colormap, table, mask):
+        Colormap.__init__(self, colormap, table)
+        self.mask = mask
+
+    def fold_lut(self, lut):
+        return MaskedColormap(self.colormap, np.ascontiguousarray(self.table[lut]), self.mask)
+
+    def run(self, image, frame):
+        if image.ndim != 2:
+            return self.mask.run(Colormap.run(self, image, frame), frame)
+        shape = image.shape + (3,)
+        mask, spans = self.mask.geometry(shape, frame)
+        # Hidden pixels are never written, so they keep the zeros of this stage's own buffer
+        out = frame.buffer("palette", shape)
+        for top, bottom, left, right, inner_left, inner_right in spans:
+            if left == right:
+                continue
+            rows = out[top:bottom]
+            cv2.applyColorMap(image[top:bottom, left:right], self.table, dst=rows[:, left:right])
+            for start, end in ((left, inner_left), (inner_right, right)):
+                if start < end:
+                    apply_mask(rows[:, start:end], mask[top:bottom, start:end])
+        return out
+
+class Dilate(Stage):
+    name = "dilate"
+
+    def __init__(self, size=3):
+        self.kernel = np.ones((size, size), np.uint8)
+
+    def run(self, image, frame):
+        return cv2.dilate(image, self.kernel, dst=frame.target(image), iterations=1)
+
+def fuse_stages(stages):
+    # Merge neighbouring lookup tables and fold them into stages that can absorb them
+    fused = []
+    for stage in stages:
+        previous = fused[-1] if fused else None
+        previous_lut = previous.lut() if previous is not None else None
+        if previous_lut is not None:
+            table = stage.lut()
+            if table is not None:
+                fused[-1] = LookupTable(table[previous_lut], previous.name + "+" + stage.name)
+                continue
+            folded = stage.fold_lut(previous_lut)
+            if folded is not None:
+                folded.name = previous.name + "+" + stage.name
+                fused[-1] = folded
+                continue
+        if previous is not None:
+            merged = previous.fold_next(stage)
+            if merged is not None:
+                merged.name = previous.name + "+" + stage.name
+                fused[-1] = merged
+                continue
+        fused.append(stage)
+    return fused
+
+class CachedPrefix:
+    # Output of a plan's static stages, filled by one frame and reused by the unchanged frames after it
+    def __init__(self, shape):
+        self.shape = shape
+        self.image = None
+        self.ready = Event()
+
+    def store(self, image):
+        self.image = image
+        self.ready.set()
+
+    def wait(self):
+        # None when the frame that was filling it failed
+        self.ready.wait()
+        return self.image
+
+class EffectPlan:
+    def __init__(self, stages, settings=None, prefix="effect", scale=1.0):
+        # Disabled stages are dropped at compile time and never allocate anything
+        self.settings = dict(settings or {})
+        self.prefix = prefix
+        # Internal processing scale; may be changed between frames
+        self.scale = scale
+        self.stages = fuse_stages([stage for stage in stages if stage.enabled(self.settings)])
+        self.updaters = [stage for stage in self.stages if type(stage).update is not Stage.update]
+        # Stages before the first animated one give the same output for the same input
+        self.static_end = next((index for index, stage in enumerate(self.stages) if stage.animated),
+                               len(self.stages))
+        self.change_detector = None
+        self.cached = None
+        self.local = local()
+        self.pipeline = self.build_pipeline_stages()
+
+    def set_change_detector(self, detector):
+        # While the detector sees no change, frames reuse the static stages' output of the last changed frame
+        self.change_detector = detector
+        self.cached = None
+        self.pipeline = self.build_pipeline_stages()
+
+    def save(self):
+        # Everything a frame leaves for the next one: trails, noise patterns, cached prefix, change reference
+        detector = None if self.change_detector is None else self.change_detector.save()
+        return [stage.save() for stage in self.stages], self.cached, detector
+
+    def restore(self, state):
+        stages, self.cached, detector = state
+        for stage, saved in zip(self.stages, stages):
+            stage.restore(saved)
+        if self.change_detector is not None:
+            self.change_detector.restore(detector)
+
+    def buffer(self, key, shape, dtype):
+        buffers = self.local.buffers
+        array = buffers.get(key)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = buffers[key] = np.zeros(shape, dtype)
+        return array
+
+    def begin(self, image):
+        frame = Frame(image, self)
+        if self.change_detector is not None and self.static_end:
+            self.detect_change(frame)
+        for stage in self.updaters:
+            stage.update(frame)
+        return frame
+
+    def detect_change(self, frame):
+        # Runs in frame order, so the cache always belongs to the latest changed frame
+        with profiler.stage(self.prefix + ".change_detect"):
+            changed = self.change_detector.changed(frame.input)
+        cached = self.cached
+        if changed or cached is None or cached.shape != frame.shape:
+            frame.fill = self.cached = CachedPrefix(frame.shape)
+        else:
+            frame.reuse = cached
+
+    def run_range(self, frame, start, end):
+        # Per-thread buffers are dropped when the resolution changes
+        if getattr(self.local, "shape", None) != frame.shape:
+            self.local.shape = frame.shape
+            self.local.buffers = {}
+        if frame.reuse is not None and start < self.static_end:
+            cached = frame.reuse.wait()
+            if cached is None:
+                frame.reuse = None
+            else:
+                frame.image = frame.reused = cached
+                start = min(end, self.static_end)
+        if start == 0 and frame.reuse is None and frame.shape != frame.input.shape:
+            # The whole chain runs on one downscaled copy
+            frame.stage_index = -1
+            with profiler.stage(self.prefix + ".downscale"):
+                frame.image = cv2.resize(frame.input, (frame.shape[1], frame.shape[0]),
+                                         dst=frame.buffer("downscale", frame.shape, frame.input.dtype),
+                                         interpolation=cv2.INTER_AREA)
+        try:
+            for index in range(start, end):
+                stage = self.stages[index]
+                frame.stage_index = index
+                with profiler.stage(self.prefix + "." + stage.name):
+                    frame.image = stage.run(frame.image, frame)
+                if frame.fill is not None and index == self.static_end - 1:
+                    frame.fill.store(frame.image.copy())
+        except BaseException:
+            # Frames waiting for this prefix process their own instead
+            if frame.fill is not None and not frame.fill.ready.is_set():
+                frame.fill.store(None)
+            raise
+        return frame
+
+    def finish(self, frame):
+        # Hand out a BGR image that no later frame will overwrite
+        image = frame.image
+        height, width = frame.input.shape[:2]
+        if image.shape[:2] != (height, width):
+            with profiler.stage(self.prefix + ".upscale"):
+                image = cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        if id(image) in frame.scratch or image is frame.reused:
+            return image.copy()
+        return image
+
+    def run(self, image):
+        if not self.stages:
+            return image
+        return self.finish(self.run_range(self.begin(image), 0, len(self.stages)))
+
+    def group(self, start, end):
+        return lambda frame: self.run_range(frame, start, end)
+
+    def build_pipeline_stages(self):
+        # Consecutive stages with the same ordering become one FramePipeline step
+        if not self.stages:
+            return []
+        ordered = bool(self.updaters) or self.change_detector is not None
+        steps = [PipelineStage(self.begin, ordered, "update")]
+        start = 0
+        for index in range(1, len(self.stages) + 1):
+            if index == len(self.stages) or self.stages[index].ordered != self.stages[start].ordered:
+                name = "+".join(stage.name for stage in self.stages[start:index])
+                steps.append(PipelineStage(self.group(start, index), self.stages[start].ordered, name))
+                start = index
+        steps.append(PipelineStage(self.finish, False, "output"))
+        return steps
+
+# Mode name -> (builder, profiler prefix); builders receive the VisionProcessor
+MODES = OrderedDict()
+
+def register_mode(name, builder, prefix=None):
+    # builder(processor) returns the list of stages for the mode
+    MODES[name] = (builder, prefix or name)
+
+def mode_names():
+    return list(MODES)
+
+def mode_prefix(name):
+    if name not in MODES:
+        raise ValueError(f"Unknown vision mode: {name}")
+    return MODES[name][1]
+
+def compile_mode(name, processor, settings=None, scale=1.0):
+    prefix = mode_prefix(name)
+    return EffectPlan(MODES[name][0](processor), settings, prefix, scale)
+
+register_mode("normal", lambda processor: [])
@@ -0,0 +1,95 @@
+import numpy as np
+from collections import deque
+from threading import Condition
+
+class FrameRingBuffer:
+    def __init__(self, capacity=4, policy="latest"):
+        if policy not in ("latest", "lossless"):
+            raise ValueError(f"Unknown buffer policy: {policy}")
+        self.capacity = max(1, capacity)
+        self.policy = policy
+        self.slots = []
+        self.free_slots = deque()
+        self.ready_slots = deque()
+        self.held_slot = None
+        self.condition = Condition()
+        self.closed = False
+        self.frames_written = 0
+        self.dropped_frames = 0
+
+    def allocate(self, shape, dtype):
+        # One extra slot for the writer and one for the frame held by the reader
+        self.slots = [np.empty(shape, dtype) for _ in range(self.capacity + 2)]
+        self.free_slots = deque(range(len(self.slots)))
+        self.ready_slots.clear()
+        self.held_slot = None
+
+    def acquire(self, shape, dtype=np.uint8):
+        with self.condition:
+            if not self.slots or self.slots[0].shape != tuple(shape) or self.slots[0].dtype != dtype:
+                self.allocate(shape, dtype)
+
+            while len(self.ready_slots) >= self.capacity and not self.closed:
+                if self.policy == "latest":
+                    # Latest frame wins: recycle the oldest frame nobody has read yet
+                    self.free_slots.append(self.ready_slots.popleft())
+                    self.dropped_frames += 1
+                else:
+                    self.condition.wait()
+
+            if self.closed:
+                return None
+            return self.free_slots.popleft()
+
+    def commit(self, index):
+        with self.condition:
+            self.ready_slots.append(index)
+            self.frames_written += 1
+            self.condition.notify_all()
+
+    def cancel(self, index):
+        with self.condition:
+            self.free_slots.append(index)
+            self.condition.notify_all()
+
+    def write(self, frame):
+        # Copy a frame into the next free slot
+        index = self.acquire(frame.shape, frame.dtype)
+        if index is None:
+            return False
+        np.copyto(self.slots[index], frame)
+        self.commit(index)
+        return True
+
+    def read(self, timeout=None):
+        # Returned frame stays valid until the next read
+        with self.condition:
+            self.release()
+            if not self.condition.wait_for(lambda: self.ready_slots or self.closed, timeout):
+                return None
+            if not self.ready_slots:
+                return None
+            if self.policy == "latest" and len(self.ready_slots) > 1:
+                # Skip straight to the newest frame; the older unread ones go back to the writer
+                while len(self.ready_slots) > 1:
+                    self.free_slots.append(self.ready_slots.popleft())
+                    self.dropped_frames += 1
+                self.condition.notify_all()
+            self.held_slot = self.ready_slots.popleft()
+            return self.slots[self.held_slot]
+
+    def release(self):
+        with self.condition:
+            if self.held_slot is not None:
+                self.free_slots.append(self.held_slot)
+                self.held_slot = None
+                self.condition.notify_all()
+
+    @property
+    def queue_depth(self):
+        return len(self.ready_slots)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
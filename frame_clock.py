@@ -0,0 +1,26 @@
+class FrameClock:
+    # Time that only moves when it is set to another frame, for footage processed faster or slower
+    # than it was shot; effects then refresh per frame instead of per wall-clock interval
+    def __init__(self, fps=30.0, start=0.0):
+        self.interval = 1.0 / fps
+        self.start = start
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def seek(self, index):
+        # Frame index is shown one interval after the one before it
+        self.now = self.start + (index + 1) * self.interval
+
+    def timed(self, stages, index):
+        # FramePipeline stages whose first step moves the clock to frame index. That step (the
+        # per-frame update) runs in frame order, so each frame's noise refresh sees its own time
+        if not stages or not stages[0].ordered:
+            return stages
+        first = stages[0]
+
+        def update(frame):
+            self.seek(index)
+            return first.func(frame)
+        return [first._replace(func=update)] + list(stages[1:])
@@ -0,0 +1,104 @@
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Barrier, Lock
+
+# A processing step; ordered steps carry state from one frame to the next
+PipelineStage = namedtuple("PipelineStage", ["func", "ordered", "name"])
+PipelineStage.__new__.__defaults__ = (False, None)
+
+def run_stages(stages, frame):
+    result = frame
+    for stage in stages:
+        result = stage.func(result)
+    return result
+
+class FramePipeline:
+    def __init__(self, workers=None, max_in_flight=None, executor=None):
+        # executor: pool shared with other pipelines; it is left running on shutdown
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max(1, max_in_flight or self.workers * 2)
+        self.owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(self.workers, thread_name_prefix="frame-worker")
+        self.executor = executor
+        self.pending = deque()
+        self.next_sequence = 0
+        # Number of ordered stages each in-flight frame has completed
+        self.ordered_progress = {}
+        self.condition = Condition()
+
+    def can_run_ordered(self, sequence, step):
+        # Every earlier frame must have passed this ordered step (or have none left)
+        for other, done in self.ordered_progress.items():
+            if other < sequence and done <= step:
+                return False
+        return True
+
+    def run_job(self, sequence, frame, stages):
+        result = frame
+        step = 0
+        try:
+            for stage in stages:
+                if stage.ordered:
+                    with self.condition:
+                        self.condition.wait_for(lambda: self.can_run_ordered(sequence, step))
+                    result = stage.func(result)
+                    step += 1
+                    with self.condition:
+                        self.ordered_progress[sequence] = step
+                        self.condition.notify_all()
+                else:
+                    result = stage.func(result)
+            return result
+        finally:
+            with self.condition:
+                del self.ordered_progress[sequence]
+                self.condition.notify_all()
+
+    def submit(self, frame, stages):
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        with self.condition:
+            self.ordered_progress[sequence] = 0
+        self.pending.append(self.executor.submit(self.run_job, sequence, frame, stages))
+
+    def run_on_workers(self, func):
+        # Calls func once on each of the pipeline's threads, one at a time, e.g. so that per-thread
+        # buffers exist before the first frame; nothing may be in flight meanwhile
+        if not self.owns_executor:
+            raise RuntimeError("The threads of a shared executor cannot be reached one by one")
+        barrier = Barrier(self.workers)
+        lock = Lock()
+
+        def run():
+            # Every thread waits here until all have a call, so each call lands on another thread
+            barrier.wait()
+            with lock:
+                func()
+        for future in [self.executor.submit(run) for _ in range(self.workers)]:
+            future.result()
+
+    @property
+    def in_flight(self):
+        return len(self.pending)
+
+    def ready(self):
+        return bool(self.pending) and self.pending[0].done()
+
+    def get(self):
+        # Results come back in submission order
+        if not self.pending:
+            return None
+        return self.pending.popleft().result()
+
+    def drain(self):
+        results = []
+        while self.pending:
+            results.append(self.get())
+        return results
+
+    def shutdown(self):
+        self.drain()
+        if self.owns_executor:
+            self.executor.shutdown(wait=True)
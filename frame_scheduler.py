@@ -0,0 +1,110 @@
+import time
+import numpy as np
+from collections import deque
+
+# drop: a late frame gives up the ticks it missed and the schedule restarts from that frame
+# catchup: missed ticks are kept, so the following frames run back to back until on schedule again
+PACING_POLICIES = ("drop", "catchup")
+
+class FrameScheduler:
+    def __init__(self, frame_rate, policy="drop", max_catchup=4, spin=0.001, window=120):
+        if policy not in PACING_POLICIES:
+            raise ValueError(f"Unknown pacing policy: {policy}")
+        self.policy = policy
+        # catchup gives up and resynchronises once it is this many ticks behind
+        self.max_catchup = max_catchup
+        # The last stretch before a deadline is busy-waited; sleeping overshoots by up to a millisecond
+        self.spin = spin
+        self.interval = 1.0 / frame_rate
+        self.deadline = None
+        self.last_tick = None
+        self.intervals = deque(maxlen=window)
+        self.late_frames = 0
+        self.dropped_ticks = 0
+
+    @property
+    def frame_rate(self):
+        return 1.0 / self.interval
+
+    def set_frame_rate(self, frame_rate):
+        interval = 1.0 / frame_rate
+        if interval != self.interval:
+            # Restart the schedule and the statistics at the new rate
+            self.interval = interval
+            self.deadline = None
+            self.last_tick = None
+            self.intervals.clear()
+
+    def wait(self, poll=None):
+        # Block until the next frame deadline. poll(timeout_ms) pumps window events and
+        # collects input while waiting; it is called at least once per frame, with 0 when late.
+        now = time.perf_counter()
+        if self.deadline is None:
+            self.deadline = now
+        behind = now - self.deadline
+        if behind <= 0:
+            self.sleep_until(self.deadline, poll)
+        else:
+            self.late_frames += 1
+            if poll is not None:
+                poll(0)
+            if self.policy == "drop" or behind > self.max_catchup * self.interval:
+                self.dropped_ticks += int(behind / self.interval)
+                self.deadline = now
+        self.tick(time.perf_counter())
+        self.deadline += self.interval
+
+    def sleep_until(self, deadline, poll):
+        polled = False
+        while True:
+            remaining = deadline - time.perf_counter() - self.spin
+            if poll is not None:
+                # waitKey has millisecond resolution and returns early on a key press
+                timeout_ms = int(remaining * 1000)
+                if timeout_ms < 1:
+                    break
+                poll(timeout_ms)
+                polled = True
+            elif remaining > 0:
+                time.sleep(remaining)
+            else:
+                break
+        if poll is not None and not polled:
+            poll(0)
+        while time.perf_counter() < deadline:
+            pass
+
+    def tick(self, now):
+        if self.last_tick is not None:
+            self.intervals.append(now - self.last_tick)
+        self.last_tick = now
+
+    @property
+    def measured_fps(self):
+        if not self.intervals:
+            return 0.0
+        return len(self.intervals) / sum(self.intervals)
+
+    @property
+    def jitter_ms(self):
+        # Standard deviation of the frame-to-frame interval
+        if len(self.intervals) < 2:
+            return 0.0
+        return float(np.std(self.intervals)) * 1000
+
+    def stats(self):
+        intervals = np.array(self.intervals) * 1000 if self.intervals else np.zeros(1)
+        return {
+            "target_fps": self.frame_rate,
+            "measured_fps": self.measured_fps,
+            "jitter_ms": self.jitter_ms,
+            "p95_interval_ms": float(np.percentile(intervals, 95)),
+            "late_frames": self.late_frames,
+            "dropped_ticks": self.dropped_ticks
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"{stats['measured_fps']:.1f}/{stats['target_fps']:.0f} fps, "
+                f"jitter {stats['jitter_ms']:.2f} ms, p95 interval {stats['p95_interval_ms']:.2f} ms, "
+                f"{stats['late_frames']} late frames, {stats['dropped_ticks']} dropped ticks")
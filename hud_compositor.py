@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+class HudLayer:
+    def __init__(self, x, y, coverage, image=None):
+        # Pre-rendered widget: top-left corner, coverage in 0-1 and optional colors
+        self.x = x
+        self.y = y
+        self.coverage = coverage
+        self.remainder = 1.0 - coverage
+        self.image = image
+        self.mask = None
+        if image is not None:
+            self.mask = (coverage > 0)[:, :, np.newaxis]
+
+    @property
+    def shape(self):
+        return self.coverage.shape[:2]
+
+def clip_box(x, y, width, height, frame_width, frame_height):
+    x1, y1 = max(0, x), max(0, y)
+    x2, y2 = min(frame_width, x + width), min(frame_height, y + height)
+    return x1, y1, x2, y2
+
+def render_text_layer(lines, frame_shape, font=FONT):
+    # lines: (text, (x, y), scale, thickness) in frame coordinates
+    frame_height, frame_width = frame_shape[:2]
+    boxes = []
+    for text, (x, y), scale, thickness in lines:
+        (text_width, text_height), baseline = cv2.getTextSize(text, font, scale, thickness)
+        boxes.append((x - thickness, y - text_height - thickness,
+                      x + text_width + thickness, y + baseline + thickness))
+    if not boxes:
+        return None
+
+    left = min(box[0] for box in boxes)
+    top = min(box[1] for box in boxes)
+    right = max(box[2] for box in boxes)
+    bottom = max(box[3] for box in boxes)
+    canvas = np.zeros((bottom - top, right - left), np.uint8)
+    for text, (x, y), scale, thickness in lines:
+        cv2.putText(canvas, text, (x - left, y - top), font, scale, 255, thickness)
+
+    # Keep only the part that lands inside the frame
+    x1, y1, x2, y2 = clip_box(left, top, right - left, bottom - top, frame_width, frame_height)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    # Anti-aliased text leaves partial coverage on the glyph edges
+    canvas = canvas[y1 - top:y2 - top, x1 - left:x2 - left]
+    return HudLayer(x1, y1, canvas.astype(np.float32) / 255)
+
+def render_image_layer(image, x, y, frame_shape):
+    # Colored widget drawn on black; black pixels stay transparent
+    frame_height, frame_width = frame_shape[:2]
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = clip_box(x, y, width, height, frame_width, frame_height)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    image = np.ascontiguousarray(image[y1 - y:y2 - y, x1 - x:x2 - x])
+    coverage = (cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) > 0).astype(np.float32)
+    return HudLayer(x1, y1, coverage, image)
+
+def color_transform(color, alpha):
+    # 3x4 affine transform that blends every pixel toward color in a single pass
+    blue, green, red = color
+    return np.array([[1 - alpha, 0, 0, alpha * blue],
+                     [0, 1 - alpha, 0, alpha * green],
+                     [0, 0, 1 - alpha, alpha * red]], np.float32)
+
+class HudCompositor:
+    def __init__(self):
+        self.layers = {}
+
+    def layer(self, name, key, builder):
+        # Re-render a widget only when the state it depends on changes
+        cached = self.layers.get(name)
+        if cached is None or cached[0] != key:
+            cached = (key, builder())
+            self.layers[name] = cached
+        return cached[1]
+
+    def blend_color(self, frame, layer, color, alpha):
+        # frame = alpha * color + (1 - alpha) * frame, only where the layer has coverage
+        if layer is None:
+            return
+        height, width = layer.shape
+        roi = frame[layer.y:layer.y + height, layer.x:layer.x + width]
+        blended = cv2.transform(roi, color_transform(color, alpha))
+        roi[:] = cv2.blendLinear(blended, roi, layer.coverage, layer.remainder)
+
+    def blend_image(self, frame, layer, alpha):
+        if layer is None:
+            return
+        height, width = layer.shape
+        roi = frame[layer.y:layer.y + height, layer.x:layer.x + width]
+        np.copyto(roi, cv2.addWeighted(roi, 1 - alpha, layer.image, alpha, 0), where=layer.mask)
+
+    def blend_rows(self, frame, rows, color, alpha):
+        # Full-width one pixel lines
+        transform = color_transform(color, alpha)
+        for row in rows:
+            line = frame[row:row + 1]
+            line[:] = cv2.transform(line, transform)
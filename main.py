@@ -1,55 +1,233 @@
-import cv2
-from vision_modes import NightVision, ThermalVision
-from camera_handler import CameraHandler
-from gui_controller import GUIController
-import time
-
-def main():
-    # Initialize core components
-    camera = CameraHandler()
-    night_vision = NightVision()
-    thermal_vision = ThermalVision()
-    gui = GUIController()
-    current_mode = "normal"
-    
-    while True:
-        start_time = time.time()
-        
-        frame = camera.get_frame()
-        if frame is None:
-            break
-            
-        # Handle zoom controls
-        if gui.last_key == ord('+') or gui.last_key == ord('='):
-            camera.zoom_in()
-        elif gui.last_key == ord('-') or gui.last_key == ord('_'):
-            camera.zoom_out()
-            
-        # Apply vision effects based on mode
-        if current_mode.startswith("night_"):
-            processed_frame = night_vision.process(frame, brightness_level=current_mode.split("_")[1])
-            night_vision.enable_noise = gui.enable_noise
-        elif current_mode.startswith("thermal_"):
-            processed_frame = thermal_vision.process(frame, mode=current_mode.split("_", 1)[1])
-            thermal_vision.enable_noise = gui.enable_noise
-            thermal_vision.enable_vignette = gui.enable_vignette
-        else:
-            processed_frame = frame
-            
-        # Update display and handle user input
-        gui.display_frame(processed_frame)
-        current_mode = gui.handle_controls()
-        
-        if gui.should_exit():
-            break
-        
-        # Maintain consistent frame rate
-        elapsed = time.time() - start_time
-        wait_time = max(1, int((1.0 / gui.frame_rate - elapsed) * 1000))
-        cv2.waitKey(wait_time)
-    
-    camera.release()
-    cv2.destroyAllWindows()
-
-if __name__ == "__main__":
-    main() 
\ No newline at end of file
+import time
+# Reference point for the time-to-first-frame report, taken before the heavy imports
+STARTED = time.perf_counter()
+import cv2
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from vision_modes import VisionProcessor, parse_processing_scales, parse_palette, register_palette
+from adaptive_scale import AdaptiveScale
+from bloom import BLOOM_METHODS
+from frame_pipeline import FramePipeline
+from profiler import profiler
+from camera_handler import CameraHandler
+from gui_controller import GUIController
+from frame_scheduler import FrameScheduler, PACING_POLICIES
+from recorder import Recorder, OVERFLOW_POLICIES
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Advanced Vision System")
+    parser.add_argument("--threaded-capture", action="store_true",
+                        help="read camera frames on a background thread")
+    parser.add_argument("--buffer-size", type=int, default=4,
+                        help="frames queued by the capture thread")
+    parser.add_argument("--buffer-policy", choices=["latest", "lossless"], default="latest",
+                        help="drop stale frames or keep every captured frame")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="process consecutive frames on this many threads")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="frames processed concurrently (default: twice the workers)")
+    parser.add_argument("--backend", choices=["thread", "process"], default="thread",
+                        help="run --workers as threads or as processes sharing frames through shared memory")
+    parser.add_argument("--clahe-crop", action="store_true",
+                        help="equalize only the square around the thermal circle (faster, changes the tile grid)")
+    parser.add_argument("--zoom-mode", choices=["resize", "roi"], default="resize",
+                        help="roi runs the effects on the zoomed crop and upscales only the result")
+    parser.add_argument("--hardware-zoom", action="store_true",
+                        help="let the camera driver zoom where it supports CAP_PROP_ZOOM")
+    parser.add_argument("--processing-scale", action="append", metavar="MODE=SCALE",
+                        help="run a mode or mode family at reduced resolution, e.g. thermal=0.5 (repeatable)")
+    parser.add_argument("--bloom", choices=BLOOM_METHODS, default="pyramid",
+                        help="glow implementation: pyramid (fast), box or gaussian (exact)")
+    parser.add_argument("--color-bloom", action="store_true",
+                        help="dilate and bloom thermal images after colormapping instead of on the luminance plane")
+    parser.add_argument("--palette", action="append", metavar="NAME=RRGGBB,...",
+                        help="add a thermal_NAME mode with a palette through these colors (repeatable)")
+    parser.add_argument("--change-threshold", type=float, default=None,
+                        help="reuse the static effect stages while no image block changes by more than this many "
+                             "gray levels. Thermal modes then add their noise after the bloom and reuse everything "
+                             "before the palette; night modes reuse only grayscale and contrast, since their noise "
+                             "feeds the phosphor trail")
+    parser.add_argument("--auto-scale", action="store_true",
+                        help="lower the processing scale while frames exceed the frame rate budget")
+    parser.add_argument("--pacing", choices=PACING_POLICIES, default="drop",
+                        help="when a frame runs late, skip the missed ticks (drop) or run the next frames back to back (catchup)")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record the processed frames without the HUD to a video file, or raw frames to a .npy path")
+    parser.add_argument("--record-raw", metavar="PATH",
+                        help="also record the camera frames before processing")
+    parser.add_argument("--record-queue", type=int, default=32,
+                        help="frames waiting for the encoder before the overflow policy applies")
+    parser.add_argument("--record-policy", choices=OVERFLOW_POLICIES, default="drop",
+                        help="what to do with frames when the encoder falls behind")
+    parser.add_argument("--record-fps", type=float, default=30.0, help="frame rate stored in recorded videos")
+    parser.add_argument("--segment-seconds", type=float, default=None,
+                        help="start a new recording file after this many seconds")
+    parser.add_argument("--segment-mb", type=float, default=None,
+                        help="start a new recording file after this many megabytes")
+    parser.add_argument("--profile", action="store_true",
+                        help="record per-stage timings from the start (P toggles the overlay)")
+    parser.add_argument("--trace-file",
+                        help="write the recorded timings to this .json or .csv file on exit")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    profiler.enabled = args.profile or bool(args.trace_file)
+
+    # Initialize core components
+    for value in args.palette or []:
+        register_palette(*parse_palette(value))
+    options = dict(bloom_method=args.bloom,
+                   luminance_bloom=not args.color_bloom, change_threshold=args.change_threshold,
+                   crop_contrast=args.clahe_crop)
+    pipeline = None
+    shared = args.workers > 1 and args.backend == "process"
+    if shared:
+        # Imported here so the thread backend does not load multiprocessing at startup;
+        # worker processes are forked before the camera threads start
+        from shared_pipeline import SharedFramePipeline
+        pipeline = SharedFramePipeline(args.workers, args.max_in_flight, options)
+    elif args.workers > 1:
+        pipeline = FramePipeline(args.workers, args.max_in_flight)
+
+    # Opening the camera can take a second; meanwhile the window is created and every mode is
+    # run once at the requested resolution, so neither the first frame nor a mode switch builds caches.
+    # Worker processes warm up in the background; worker threads each run the modes once for their buffers
+    startup = ThreadPoolExecutor(1)
+    opening = startup.submit(CameraHandler, threaded=args.threaded_capture,
+                             buffer_size=args.buffer_size,
+                             buffer_policy=args.buffer_policy,
+                             zoom_mode=args.zoom_mode,
+                             hardware_zoom=args.hardware_zoom)
+    processor = VisionProcessor(**options)
+    processor.processing_scales = parse_processing_scales(args.processing_scale)
+    gui = GUIController(modes=processor.modes())
+    warm_start = time.perf_counter()
+    width, height = CameraHandler.default_resolution
+    warm_shape = (height, width, 3)
+    def warm_up(shape):
+        if shared:
+            pipeline.warm_up(processor.modes(), shape, processor)
+        if pipeline is not None and not shared:
+            pipeline.run_on_workers(lambda: processor.warm_up(processor.modes(), shape))
+        else:
+            processor.warm_up(processor.modes(), shape)
+    warm_up(warm_shape)
+    gui.warm_up()
+    warm_time = time.perf_counter() - warm_start
+    camera = opening.result()
+    startup.shutdown()
+    camera_wait = time.perf_counter() - warm_start - warm_time
+    if camera.frame_shape != warm_shape:
+        # The device settled on another resolution
+        warm_up(camera.frame_shape)
+    if args.auto_scale:
+        processor.auto_scale = AdaptiveScale()
+    # Encoding runs on recorder threads; the loop only copies each frame into a bounded queue
+    recorders = []
+    for path in (args.record, args.record_raw):
+        recorders.append(None if path is None else Recorder(
+            path, args.record_fps, args.record_queue, args.record_policy, args.segment_seconds,
+            None if args.segment_mb is None else int(args.segment_mb * 1024 * 1024)))
+    recorder, raw_recorder = recorders
+    current_mode = "normal"
+    scheduler = FrameScheduler(gui.frame_rate, args.pacing)
+    first_frame = True
+    # Modes still to be warmed up after the noise or vignette setting changed, one per frame
+    warm_queue = deque()
+
+    while True:
+        start_time = time.perf_counter()
+
+        # With worker processes the camera reads straight into a shared memory slot
+        slot = pipeline.acquire(camera.frame_shape) if shared else None
+        frame = camera.get_frame(slot)
+        if frame is None:
+            break
+        if raw_recorder is not None:
+            # The full camera frame, whatever the zoom; ROI crops would start a new segment per size
+            raw_recorder.write(camera.raw_frame)
+
+        # Apply vision effects based on mode
+        settings = processor.settings
+        processor.update_settings(gui.enable_noise, gui.enable_vignette)
+        if processor.settings != settings and pipeline is None:
+            # Every mode compiles a new plan for the new settings; with worker pools the
+            # warm-up could race the workers over shared trail and noise state
+            warm_queue.extend(mode for mode in processor.modes() if mode != current_mode)
+        if pipeline is None:
+            processed_frame = processor.process(frame, current_mode)
+        elif shared:
+            # Frames outside the slot (threaded capture, resize zoom, ROI while easing) are copied into it once
+            pipeline.submit(frame, current_mode, processor)
+        else:
+            # Threaded capture and zoom reuse their buffers, so in-flight frames need their own copy
+            pipeline.submit(frame.copy() if camera.reuses_buffers else frame, processor.stages(current_mode))
+        if pipeline is not None:
+            # Keep feeding the workers until the oldest frame is ready
+            if pipeline.in_flight < pipeline.max_in_flight and not pipeline.ready():
+                continue
+            processed_frame = pipeline.get()
+
+        # Update display
+        processed_frame = camera.finish_zoom(processed_frame)
+        if recorder is not None:
+            recorder.write(processed_frame)
+        if camera.threaded:
+            gui.capture_status = f"CAP Q{camera.queue_depth}/{args.buffer_size} DROP {camera.dropped_frames}"
+        gui.recording_status = [item.status() for item in recorders if item is not None]
+        gui.display_frame(processed_frame)
+        if first_frame:
+            first_frame = False
+            print(f"First frame after {(time.perf_counter() - STARTED) * 1000:.0f} ms "
+                  f"(warm-up {warm_time * 1000:.0f} ms, then {camera_wait * 1000:.0f} ms waiting for the camera)")
+
+        elapsed = time.perf_counter() - start_time
+        profiler.record("frame", elapsed)
+        if processor.auto_scale is not None:
+            processor.auto_scale.update(elapsed, 1.0 / gui.frame_rate)
+
+        # Warm-ups use the time the scheduler would otherwise wait
+        if warm_queue:
+            processor.warm_up([warm_queue.popleft()], frame.shape)
+
+        # Spend the rest of the frame budget collecting input until the next deadline
+        scheduler.set_frame_rate(gui.frame_rate)
+        scheduler.wait(gui.poll_input)
+        gui.jitter_ms = scheduler.jitter_ms
+
+        # Handle user input
+        current_mode = gui.handle_controls()
+        while gui.zoom_steps > 0:
+            camera.zoom_in()
+            gui.zoom_steps -= 1
+        while gui.zoom_steps < 0:
+            camera.zoom_out()
+            gui.zoom_steps += 1
+
+        if gui.should_exit():
+            break
+
+    if pipeline is not None:
+        # Frames still in flight are recorded before the recorders close
+        for result in pipeline.drain():
+            if recorder is not None:
+                recorder.write(camera.finish_zoom(result))
+        pipeline.shutdown()
+    for item in recorders:
+        if item is not None:
+            item.close()
+            print(f"Recorded {item.path}: {item.stats()}")
+    camera.release()
+    cv2.destroyAllWindows()
+    print(f"Frame pacing: {scheduler.summary()}")
+    for line in processor.change_summary():
+        print(f"Change detection {line}")
+    if camera.threaded:
+        print(f"Capture: {camera.dropped_frames} stale frames dropped ({args.buffer_policy} policy)")
+    if args.trace_file:
+        profiler.dump(args.trace_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+from collections import OrderedDict
+from threading import Lock
+
+class MaskCache:
+    def __init__(self, max_resolutions=1):
+        # Masks only depend on frame geometry, so they are grouped per resolution
+        # and whole groups are evicted once the resolution changes
+        self.max_resolutions = max_resolutions
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, shape, name, builder, *params):
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) > 2 else 1
+        resolution = (height, width)
+        key = (name, channels) + params
+
+        with self.lock:
+            masks = self.entries.get(resolution)
+            if masks is None:
+                masks = {}
+                self.entries[resolution] = masks
+                while len(self.entries) > self.max_resolutions:
+                    self.entries.popitem(last=False)
+            else:
+                self.entries.move_to_end(resolution)
+
+            mask = masks.get(key)
+            if mask is None:
+                mask = builder(height, width, *params)
+                if channels > 1:
+                    mask = cv2.merge([mask] * channels)
+                masks[key] = mask
+        return mask
+
+def distance_map(height, width):
+    center_x, center_y = width // 2, height // 2
+    Y, X = np.ogrid[:height, :width]
+    X = (X - center_x).astype(np.float32)
+    Y = (Y - center_y).astype(np.float32)
+    return np.sqrt(X**2 + Y**2)
+
+def build_vignette_mask(height, width, strength=1.5):
+    # Radial falloff from the center, stored as fixed-point 0-255 weights
+    center_x, center_y = width // 2, height // 2
+    dist_from_center = distance_map(height, width)
+    vignette = 1 - dist_from_center / np.float32(np.sqrt(center_x**2 + center_y**2))
+    vignette = np.clip(vignette * np.float32(strength), 0, 1)
+    return np.round(vignette * 255).astype(np.uint8)
+
+def build_circular_mask(height, width, margin=10, fade_width=30):
+    # Full weight inside the circle, linear fade to black over fade_width pixels
+    center_x, center_y = width // 2, height // 2
+    radius = min(center_x, center_y) - margin
+    dist_from_center = distance_map(height, width)
+    fade = 1 - (dist_from_center - radius) / np.float32(fade_width)
+    fade = np.clip(fade, 0, 1)
+    return np.round(fade * 255).astype(np.uint8)
+
+def circular_mask_box(height, width, margin=10, fade_width=30):
+    # Bounding box of the pixels build_circular_mask leaves visible
+    center_x, center_y = width // 2, height // 2
+    reach = min(center_x, center_y) - margin + fade_width
+    return (max(0, center_x - reach), max(0, center_y - reach),
+            min(width, center_x + reach + 1), min(height, center_y + reach + 1))
+
+def build_fade_spans(height, width, margin=10, fade_width=30, band=16):
+    # Per band of rows: (top, bottom, left, right, inner_left, inner_right) where the circular mask
+    # is visible in [left, right) and fully opaque in [inner_left, inner_right); only the rest needs the fade
+    mask = build_circular_mask(height, width, margin, fade_width)
+    spans = []
+    for top in range(0, height, band):
+        rows = mask[top:top + band]
+        visible = np.flatnonzero(rows.max(axis=0))
+        opaque = np.flatnonzero(rows.min(axis=0) == 255)
+        left, right = (int(visible[0]), int(visible[-1]) + 1) if visible.size else (0, 0)
+        inner_left, inner_right = (int(opaque[0]), int(opaque[-1]) + 1) if opaque.size else (right, right)
+        spans.append((top, min(height, top + band), left, right, inner_left, inner_right))
+    return spans
+
+def apply_mask(frame, mask, dst=None):
+    # Single fused multiply, in place by default: frame * mask / 255 with saturation
+    return cv2.multiply(frame, mask, dst=frame if dst is None else dst, scale=1.0 / 255)
+
+# Room for a full-resolution and a reduced processing scale at the same time
+shared_mask_cache = MaskCache(max_resolutions=2)
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+from collections import OrderedDict
+
+# Noise is stored around this value so uint8 tiles hold both signs
+NOISE_OFFSET = 128
+
+class NoiseBank:
+    def __init__(self, sigma, tiles=4, margin=32, blur=None, intensity=(1.0, 1.0), seed=None,
+                 max_resolutions=2):
+        # tiles: full-frame noise textures built once per resolution
+        # margin: extra rows and columns so every sample can start at a random offset
+        # max_resolutions: banks kept so switching processing scales does not rebuild them
+        self.sigma = sigma
+        self.tiles = tiles
+        self.margin = margin
+        self.blur = blur
+        self.intensity = intensity
+        self.seed = seed
+        # Only for sampling; each resolution's tiles come from their own generator, so the tiles do not
+        # depend on which resolutions were built or sampled before
+        self.rng = np.random.default_rng(seed)
+        self.max_resolutions = max_resolutions
+        self.banks = OrderedDict()
+
+    def build(self, shape):
+        height, width = shape
+        rng = np.random.default_rng(None if self.seed is None else [self.seed, height, width])
+        bank = []
+        for _ in range(self.tiles):
+            noise = rng.standard_normal((height + self.margin, width + self.margin), dtype=np.float32)
+            noise *= self.sigma
+            if self.blur is not None:
+                noise = cv2.GaussianBlur(noise, self.blur, 0)
+            noise += NOISE_OFFSET
+            bank.append(np.clip(np.rint(noise), 0, 255).astype(np.uint8))
+        return bank
+
+    def sample(self, shape):
+        # A random window of a random tile plus an intensity scale; no per-frame generation
+        height, width = shape
+        key = self.find_bank(shape)
+        if key is None:
+            key = shape
+            self.banks[key] = self.build(shape)
+            while len(self.banks) > self.max_resolutions:
+                self.banks.popitem(last=False)
+        else:
+            self.banks.move_to_end(key)
+        tile = self.banks[key][self.rng.integers(self.tiles)]
+        y = self.rng.integers(tile.shape[0] - height + 1)
+        x = self.rng.integers(tile.shape[1] - width + 1)
+        return tile[y:y + height, x:x + width], float(self.rng.uniform(*self.intensity))
+
+    def save(self):
+        # Sampling position; restoring it repeats the same windows and intensities
+        return self.rng.bit_generator.state
+
+    def restore(self, state):
+        self.rng.bit_generator.state = state
+
+    def find_bank(self, shape):
+        # Smaller frames, such as zoomed crops, are windows into an existing larger bank
+        if shape in self.banks:
+            return shape
+        height, width = shape
+        for key in self.banks:
+            if key[0] >= height and key[1] >= width:
+                return key
+        return None
+
+def add_noise(image, noise, dst=None):
+    # image + scale * (tile - NOISE_OFFSET) with saturation, in a single pass
+    tile, scale = noise
+    if dst is None:
+        return cv2.addWeighted(image, 1.0, tile, scale, -NOISE_OFFSET * scale)
+    return cv2.addWeighted(image, 1.0, tile, scale, -NOISE_OFFSET * scale, dst=dst)
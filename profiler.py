@@ -0,0 +1,114 @@
+import csv
+import json
+import numpy as np
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+from time import perf_counter
+
+# Histogram bucket upper bounds in milliseconds
+HISTOGRAM_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, 133, float("inf")]
+
+class StageStats:
+    def __init__(self, window=240):
+        self.samples = deque(maxlen=window)
+        self.histogram = [0] * len(HISTOGRAM_BOUNDS_MS)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        milliseconds = seconds * 1000.0
+        self.samples.append(milliseconds)
+        self.histogram[bisect_left(HISTOGRAM_BOUNDS_MS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+
+    def summary(self):
+        recent = np.array(self.samples) if self.samples else np.zeros(1)
+        return {
+            "count": self.count,
+            "mean_ms": float(recent.mean()),
+            "p50_ms": float(np.percentile(recent, 50)),
+            "p95_ms": float(np.percentile(recent, 95)),
+            "max_ms": float(recent.max()),
+            "total_ms": self.total,
+            "histogram": dict(zip([str(bound) for bound in HISTOGRAM_BOUNDS_MS], self.histogram))
+        }
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class StageTimer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, perf_counter() - self.start, self.start)
+        return False
+
+NULL_TIMER = NullTimer()
+
+class Profiler:
+    def __init__(self, enabled=False, window=240, trace_size=100000):
+        self.enabled = enabled
+        self.window = window
+        self.stats = {}
+        self.trace = deque(maxlen=trace_size)
+        self.lock = Lock()
+        self.origin = perf_counter()
+
+    def stage(self, name):
+        # Disabled profiling hands out one shared no-op context manager
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self, name)
+
+    def record(self, name, seconds, start=None):
+        if not self.enabled:
+            return
+        start = perf_counter() - seconds if start is None else start
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = StageStats(self.window)
+            stats.add(seconds)
+            self.trace.append((start - self.origin, name, seconds))
+
+    def summary(self):
+        with self.lock:
+            return {name: stats.summary() for name, stats in self.stats.items()}
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.trace.clear()
+            self.origin = perf_counter()
+
+    def dump(self, path):
+        # CSV gets one row per timed stage, JSON adds the rolling summaries
+        with self.lock:
+            events = list(self.trace)
+        if path.lower().endswith(".csv"):
+            with open(path, "w", newline="") as handle:
+                writer = csv.writer(handle)
+                writer.writerow(["start_ms", "stage", "duration_ms"])
+                for start, name, seconds in events:
+                    writer.writerow([f"{start * 1000:.3f}", name, f"{seconds * 1000:.3f}"])
+        else:
+            with open(path, "w") as handle:
+                json.dump({
+                    "summary": self.summary(),
+                    "trace": [{"start_ms": start * 1000, "stage": name, "duration_ms": seconds * 1000}
+                              for start, name, seconds in events]
+                }, handle, indent=2)
+
+profiler = Profiler()
@@ -0,0 +1,254 @@
+import os
+import cv2
+import time
+import numpy as np
+from collections import deque
+from threading import Thread, Condition
+
+# drop: frames arriving while the queue is full are discarded
+# block: the caller waits for the encoder (never use this for the live view)
+# degrade: past half full only every other frame is queued, then frames are dropped
+OVERFLOW_POLICIES = ("drop", "block", "degrade")
+
+def recording_files(path):
+    # The files a recording to path produced: path itself, or its numbered segments in order
+    if os.path.exists(path):
+        return [path]
+    base, extension = os.path.splitext(path)
+    files = []
+    while os.path.exists(f"{base}_{len(files):04d}{extension}"):
+        files.append(f"{base}_{len(files):04d}{extension}")
+    return files
+
+class VideoSegment:
+    def __init__(self, path, shape, fps=30.0, codec="mp4v"):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.shape = shape
+        self.frames = 0
+        height, width = shape[:2]
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height),
+                                      len(shape) == 3)
+        if not self.writer.isOpened():
+            raise IOError(f"Cannot open video writer: {path}")
+
+    @property
+    def full(self):
+        return False
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def write(self, frame):
+        self.writer.write(frame)
+        self.frames += 1
+
+    def close(self):
+        self.writer.release()
+
+class NpySegment:
+    def __init__(self, path, shape, capacity):
+        # Lossless dump into a preallocated memory-mapped .npy, shrunk to the written frames on close
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.shape = shape
+        self.frames = 0
+        self.array = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(capacity,) + shape)
+        self.capacity = capacity
+        self.offset = self.array.offset
+
+    @property
+    def full(self):
+        return self.frames >= self.capacity
+
+    @property
+    def size(self):
+        return self.offset + self.frames * int(np.prod(self.shape))
+
+    def write(self, frame):
+        self.array[self.frames] = frame
+        self.frames += 1
+
+    def close(self):
+        self.array.flush()
+        self.array = None
+        truncate_npy(self.path, self.offset, (self.frames,) + self.shape)
+
+def truncate_npy(path, offset, shape):
+    # Rewrite the header in place for the new shape, padded to the same length, and cut off the rest
+    header = "{'descr': '|u1', 'fortran_order': False, 'shape': %r, }" % (shape,)
+    with open(path, "r+b") as file:
+        major, _ = np.lib.format.read_magic(file)
+        start = 10 if major == 1 else 12
+        file.seek(start)
+        file.write((header + " " * (offset - start - len(header) - 1) + "\n").encode("latin1"))
+        file.truncate(offset + int(np.prod(shape)))
+
+class Recorder:
+    def __init__(self, path, fps=30.0, queue_size=32, policy="drop", segment_seconds=None,
+                 segment_bytes=None, codec="mp4v", npy_frames=300):
+        # path ending in .npy records raw frames, anything else is encoded as video
+        # Segments roll over after segment_seconds or segment_bytes, and always when the frame size changes
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.path = path
+        self.fps = fps
+        self.queue_size = max(1, queue_size)
+        self.policy = policy
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.codec = codec
+        self.raw = path.lower().endswith(".npy")
+        # Frames per .npy segment when no size limit applies
+        self.npy_frames = npy_frames
+        self.queue = deque()
+        # Copies are recycled so recording allocates nothing per frame once warm
+        self.spare = deque()
+        self.condition = Condition()
+        self.closed = False
+        self.error = None
+        self.segment = None
+        self.segment_start = None
+        self.segment_index = 0
+        self.segments = []
+        self.frames_queued = 0
+        self.frames_written = 0
+        self.dropped_frames = 0
+        self.skipped_frames = 0
+        self.bytes_written = 0
+        self.write_times = deque(maxlen=60)
+        self.thread = Thread(target=self.encode_loop, name="recorder", daemon=True)
+        self.thread.start()
+
+    def write(self, frame, timestamp=None):
+        # Copies the frame and returns at once (unless the policy is block); False when it was not queued
+        timestamp = time.perf_counter() if timestamp is None else timestamp
+        with self.condition:
+            if self.closed or self.error is not None:
+                return False
+            if self.policy == "block":
+                self.condition.wait_for(lambda: len(self.queue) < self.queue_size or self.error is not None)
+            elif len(self.queue) >= self.queue_size:
+                self.dropped_frames += 1
+                return False
+            elif self.policy == "degrade" and len(self.queue) >= self.queue_size // 2 and self.frames_queued % 2:
+                self.frames_queued += 1
+                self.skipped_frames += 1
+                return False
+            copy = self.spare.pop() if self.spare else None
+        if copy is None or copy.shape != frame.shape or copy.dtype != frame.dtype:
+            copy = np.empty_like(frame)
+        np.copyto(copy, frame)
+        with self.condition:
+            self.queue.append((copy, timestamp))
+            self.frames_queued += 1
+            self.condition.notify_all()
+        return True
+
+    def encode_loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.closed)
+                if not self.queue:
+                    break
+                frame, timestamp = self.queue[0]
+            try:
+                self.encode(frame, timestamp)
+            except Exception as error:
+                with self.condition:
+                    self.error = error
+                    self.queue.clear()
+                    self.condition.notify_all()
+                break
+            with self.condition:
+                self.queue.popleft()
+                if len(self.spare) < 2:
+                    self.spare.append(frame)
+                self.condition.notify_all()
+        try:
+            self.close_segment()
+        except Exception as error:
+            self.error = self.error or error
+
+    def segment_path(self):
+        # An unsegmented video keeps the exact name unless the frame size changes
+        if self.segment_seconds is None and self.segment_bytes is None and not self.raw and not self.segment_index:
+            return self.path
+        base, extension = os.path.splitext(self.path)
+        return f"{base}_{self.segment_index:04d}{extension}"
+
+    def open_segment(self, shape, timestamp):
+        path = self.segment_path()
+        if self.raw:
+            capacity = self.npy_frames
+            if self.segment_bytes:
+                capacity = max(1, self.segment_bytes // int(np.prod(shape)))
+            elif self.segment_seconds:
+                # Room for twice the nominal rate; a full dump starts the next segment early
+                capacity = max(1, int(np.ceil(self.segment_seconds * self.fps * 2)))
+            self.segment = NpySegment(path, shape, capacity)
+        else:
+            self.segment = VideoSegment(path, shape, self.fps, self.codec)
+        self.segment_start = timestamp
+        self.segment_index += 1
+        self.segments.append(path)
+
+    def close_segment(self):
+        if self.segment is not None:
+            segment = self.segment
+            self.segment = None
+            segment.close()
+            self.bytes_written += segment.size
+
+    def encode(self, frame, timestamp):
+        segment = self.segment
+        if segment is not None and (segment.shape != frame.shape or segment.full
+                                    or (self.segment_seconds and timestamp - self.segment_start >= self.segment_seconds)
+                                    or (self.segment_bytes and segment.frames % 30 == 0
+                                        and segment.size >= self.segment_bytes)):
+            self.close_segment()
+        if self.segment is None:
+            self.open_segment(frame.shape, timestamp)
+        self.segment.write(frame)
+        self.frames_written += 1
+        self.write_times.append(time.perf_counter())
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    @property
+    def throughput(self):
+        # Frames encoded per second over the recent window
+        if len(self.write_times) < 2:
+            return 0.0
+        span = self.write_times[-1] - self.write_times[0]
+        return (len(self.write_times) - 1) / span if span > 0 else 0.0
+
+    def stats(self):
+        return {
+            "frames_written": self.frames_written,
+            "dropped_frames": self.dropped_frames,
+            "skipped_frames": self.skipped_frames,
+            "queue_depth": self.queue_depth,
+            "throughput_fps": self.throughput,
+            "segments": len(self.segments),
+            "error": None if self.error is None else str(self.error)
+        }
+
+    def status(self):
+        # One HUD line
+        if self.error is not None:
+            return "REC ERROR"
+        text = f"REC {self.throughput:.0f}fps Q{self.queue_depth}/{self.queue_size} DROP {self.dropped_frames}"
+        if self.skipped_frames:
+            text += f" SKIP {self.skipped_frames}"
+        return text
+
+    def close(self):
+        # Waits until every queued frame is written
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
@@ -0,0 +1,245 @@
+import os
+import sys
+import cv2
+import json
+import time
+import argparse
+import numpy as np
+from batch_processor import FrameSource
+from bloom import BLOOM_METHODS
+from effect_graph import mode_names
+from frame_clock import FrameClock
+from gui_controller import GUIController
+from recorder import recording_files
+from shared_pipeline import SharedFramePipeline
+from vision_modes import VisionProcessor, parse_processing_scales
+
+# Replay settings stored with the golden files and reused when checking against them
+DEFAULT_CONFIG = {
+    "seed": 0,
+    "fps": 30.0,
+    "enable_noise": True,
+    "enable_vignette": True,
+    "hud": False,
+    "bloom_method": "pyramid",
+    "luminance_bloom": True,
+    "change_threshold": None,
+    "processing_scales": {}
+}
+
+def load_frames(source, limit=None):
+    # A .npy dump from recorder.py, or anything batch_processor.FrameSource reads
+    if source.lower().endswith(".npy"):
+        # A --record-raw path stands for all of its numbered segments
+        files = recording_files(source)
+        if not files:
+            raise FileNotFoundError(f"No recording at {source}")
+        frames = []
+        for path in files:
+            segment = np.load(path, mmap_mode="r")
+            frames.extend(np.array(frame) for frame in segment[:None if limit is None else limit - len(frames)])
+            if limit is not None and len(frames) >= limit:
+                break
+        return frames
+    frame_source = FrameSource(source, 0, limit)
+    try:
+        return [frame for _, frame in frame_source]
+    finally:
+        frame_source.release()
+
+def replay_mode(frames, mode, config, workers=1):
+    # Yields the output for each input frame; each one is only valid until the next is requested
+    # workers > 1 replays through the process backend, which must give the same frames
+    clock = FrameClock(config["fps"])
+    processor = VisionProcessor(config["seed"], config["bloom_method"], config["luminance_bloom"],
+                                config["change_threshold"], clock)
+    processor.processing_scales = dict(config["processing_scales"])
+    processor.update_settings(config["enable_noise"], config["enable_vignette"])
+    gui = None
+    if config["hud"]:
+        gui = GUIController(headless=True, clock=clock, rng=np.random.default_rng(config["seed"]))
+        gui.current_mode = mode
+        gui.enable_noise = config["enable_noise"]
+        gui.enable_vignette = config["enable_vignette"]
+
+    def output(index, result):
+        if gui is not None:
+            # The HUD sees the clock of its own frame, however far ahead the submissions are
+            clock.seek(index)
+            gui.display_frame(result)
+        return result
+
+    if workers <= 1:
+        for index, frame in enumerate(frames):
+            clock.seek(index)
+            yield output(index, processor.process(frame.copy(), mode))
+        return
+    # The workers compile the same stage lists, which depend on the bloom and change detection settings
+    pipeline = SharedFramePipeline(workers, options=dict(bloom_method=config["bloom_method"],
+                                                         luminance_bloom=config["luminance_bloom"],
+                                                         change_threshold=config["change_threshold"]))
+    try:
+        done = 0
+        for index, frame in enumerate(frames):
+            clock.seek(index)
+            pipeline.submit(frame, mode, processor)
+            if pipeline.in_flight >= pipeline.max_in_flight:
+                yield output(done, pipeline.get())
+                done += 1
+        while done < len(frames):
+            yield output(done, pipeline.get())
+            done += 1
+    finally:
+        pipeline.close()
+
+def psnr(expected, actual):
+    # OpenCV caps identical images at about 361 dB
+    return float(cv2.PSNR(expected, actual))
+
+def ssim(expected, actual):
+    # Mean structural similarity over all channels with an 11x11 Gaussian window (sigma 1.5)
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    x = expected.astype(np.float32)
+    y = actual.astype(np.float32)
+
+    def window(image):
+        return cv2.GaussianBlur(image, (11, 11), 1.5)
+
+    mu_x = window(x)
+    mu_y = window(y)
+    mu_xy = mu_x * mu_y
+    mu_xx = mu_x * mu_x
+    mu_yy = mu_y * mu_y
+    var_x = window(x * x) - mu_xx
+    var_y = window(y * y) - mu_yy
+    covariance = window(x * y) - mu_xy
+    score = ((2 * mu_xy + c1) * (2 * covariance + c2)) / ((mu_xx + mu_yy + c1) * (var_x + var_y + c2))
+    return float(score.mean())
+
+def golden_path(golden_dir, mode):
+    return os.path.join(golden_dir, mode + ".npy")
+
+def record_golden(frames, modes, golden_dir, config):
+    # Writes one lossless .npy per mode and a manifest with the replay settings
+    os.makedirs(golden_dir, exist_ok=True)
+    for mode in modes:
+        golden = None
+        for index, result in enumerate(replay_mode(frames, mode, config)):
+            if golden is None:
+                golden = np.lib.format.open_memmap(golden_path(golden_dir, mode), mode="w+",
+                                                   dtype=result.dtype, shape=(len(frames),) + result.shape)
+            golden[index] = result
+        if golden is not None:
+            golden.flush()
+        print(f"Recorded {len(frames)} frames of {mode}")
+    manifest = {"config": config, "frames": len(frames), "modes": list(modes)}
+    with open(os.path.join(golden_dir, "manifest.json"), "w") as handle:
+        json.dump(manifest, handle, indent=2)
+
+def check_mode(frames, mode, golden_dir, config, min_psnr, min_ssim, diff_dir=None, workers=1, exact=False):
+    golden = np.load(golden_path(golden_dir, mode), mmap_mode="r")
+    result = {"mode": mode, "frames": len(frames), "min_psnr_db": None, "min_ssim": None,
+              "worst_frame": None, "passed": True, "error": None}
+    if len(golden) != len(frames):
+        result.update(passed=False, error=f"golden has {len(golden)} frames, replay has {len(frames)}")
+        return result
+    worst = None
+    for index, actual in enumerate(replay_mode(frames, mode, config, workers)):
+        expected = np.asarray(golden[index])
+        if expected.shape != actual.shape:
+            result.update(passed=False, worst_frame=index,
+                          error=f"frame {index} is {actual.shape}, golden is {expected.shape}")
+            return result
+        frame_psnr = psnr(expected, actual)
+        frame_ssim = ssim(expected, actual) if frame_psnr < 100 else 1.0
+        if result["min_psnr_db"] is None or frame_psnr < result["min_psnr_db"]:
+            result["min_psnr_db"] = frame_psnr
+            result["worst_frame"] = index
+            worst = (expected.copy(), actual.copy())
+        if result["min_ssim"] is None or frame_ssim < result["min_ssim"]:
+            result["min_ssim"] = frame_ssim
+        if frame_psnr < min_psnr or frame_ssim < min_ssim or (exact and not np.array_equal(expected, actual)):
+            result["passed"] = False
+    if not result["passed"] and diff_dir is not None and worst is not None:
+        # Golden, replayed and a 10x amplified difference of the frame with the lowest PSNR
+        os.makedirs(diff_dir, exist_ok=True)
+        expected, actual = worst
+        difference = cv2.convertScaleAbs(cv2.absdiff(expected, actual), alpha=10)
+        for name, image in (("golden", expected), ("replay", actual), ("diff", difference)):
+            cv2.imwrite(os.path.join(diff_dir, f"{mode}_{result['worst_frame']:05d}_{name}.png"), image)
+    return result
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay recorded frames through the vision modes and "
+                                                 "compare the output with golden files")
+    parser.add_argument("input", help=".npy frame dump, video file, image directory or glob pattern")
+    parser.add_argument("golden", help="directory holding the golden .npy files and manifest.json")
+    parser.add_argument("--update", action="store_true",
+                        help="record new golden files with the settings below instead of checking")
+    parser.add_argument("--modes", nargs="+", help="modes to replay (default: all but normal, "
+                                                   "or the modes in the manifest)")
+    parser.add_argument("--frames", type=int, default=None, help="replay at most this many frames")
+    parser.add_argument("--min-psnr", type=float, default=40.0, help="lowest PSNR in dB any frame may have")
+    parser.add_argument("--min-ssim", type=float, default=0.99, help="lowest SSIM any frame may have")
+    parser.add_argument("--diff-dir", help="write the worst frame of every failing mode here")
+    parser.add_argument("--report", help="write the comparison results to this JSON file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="replay through this many worker processes (the --backend process pipeline)")
+    parser.add_argument("--exact", action="store_true", help="fail on any pixel that differs from the golden")
+    # Only used with --update; checks reuse the settings from the manifest
+    parser.add_argument("--seed", type=int, default=0, help="noise and HUD seed")
+    parser.add_argument("--fps", type=float, default=30.0, help="replay clock rate")
+    parser.add_argument("--no-noise", action="store_true", help="disable noise")
+    parser.add_argument("--no-vignette", action="store_true", help="disable vignette")
+    parser.add_argument("--hud", action="store_true", help="include the headless HUD overlay")
+    parser.add_argument("--bloom", choices=BLOOM_METHODS, default="pyramid")
+    parser.add_argument("--color-bloom", action="store_true")
+    parser.add_argument("--change-threshold", type=float, default=None)
+    parser.add_argument("--processing-scale", action="append", metavar="MODE=SCALE")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    # The HUD timestamp is formatted in local time; pin it so golden files match on every machine
+    os.environ["TZ"] = "UTC"
+    if hasattr(time, "tzset"):
+        time.tzset()
+    frames = load_frames(args.input, args.frames)
+    if not frames:
+        sys.exit(f"No frames in {args.input}")
+
+    if args.update:
+        config = dict(DEFAULT_CONFIG, seed=args.seed, fps=args.fps, enable_noise=not args.no_noise,
+                      enable_vignette=not args.no_vignette, hud=args.hud,
+                      bloom_method=args.bloom, luminance_bloom=not args.color_bloom,
+                      change_threshold=args.change_threshold,
+                      processing_scales=parse_processing_scales(args.processing_scale))
+        modes = args.modes or [mode for mode in mode_names() if mode != "normal"]
+        record_golden(frames, modes, args.golden, config)
+        return
+
+    with open(os.path.join(args.golden, "manifest.json")) as handle:
+        manifest = json.load(handle)
+    config = dict(DEFAULT_CONFIG, **manifest["config"])
+    results = []
+    for mode in args.modes or manifest["modes"]:
+        result = check_mode(frames, mode, args.golden, config, args.min_psnr, args.min_ssim, args.diff_dir,
+                            args.workers, args.exact)
+        results.append(result)
+        if result["error"] is not None:
+            detail = result["error"]
+        else:
+            detail = (f"min PSNR {result['min_psnr_db']:6.1f} dB  min SSIM {result['min_ssim']:.4f}  "
+                      f"worst frame {result['worst_frame']}")
+        print(f"{'PASS' if result['passed'] else 'FAIL'} {mode:<18} {detail}")
+
+    if args.report:
+        with open(args.report, "w") as handle:
+            json.dump({"config": config, "min_psnr_db": args.min_psnr, "min_ssim": args.min_ssim,
+                       "results": results}, handle, indent=2)
+    if not all(result["passed"] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
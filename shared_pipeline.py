@@ -0,0 +1,486 @@
+import os
+import signal
+import weakref
+import traceback
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+from collections import deque, OrderedDict
+from queue import Empty
+
+def attach_segment(name):
+    # Workers only map the segments; the parent owns and unlinks them
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the segment with a resource tracker,
+        # which would unlink it as a leak when this worker exits
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+def byte_bounds(array):
+    # First and one-past-last byte address an array (or strided view) touches
+    low = high = array.__array_interface__["data"][0]
+    for size, stride in zip(array.shape, array.strides):
+        if stride < 0:
+            low += stride * (size - 1)
+        else:
+            high += stride * (size - 1)
+    return low, high + array.itemsize
+
+def worker_loop(options, tasks, results):
+    # Ctrl+C is handled by the parent, which stops the workers in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from vision_modes import VisionProcessor
+    from effect_graph import Frame
+    processor = VisionProcessor(**options)
+    segments = {}
+
+    def view(name, offset, shape, strides):
+        segment = segments.get(name)
+        if segment is None:
+            segment = segments[name] = attach_segment(name)
+        return np.ndarray(shape, np.uint8, segment.buf, offset, strides)
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if task == "reset":
+                # The parent reallocated its slots
+                for segment in segments.values():
+                    segment.close()
+                segments.clear()
+                continue
+            if task[0] == "warm":
+                # Build this worker's masks, tables and buffers before its first frame
+                _, modes, shape, settings, scales = task
+                processor.update_settings(**settings)
+                processor.processing_scales = scales
+                try:
+                    processor.warm_up(modes, shape)
+                except Exception:
+                    # The first real frame of the mode reports the same error
+                    pass
+                continue
+            if task[0] == "release":
+                # The parent dropped a shared noise tile
+                segment = segments.pop(task[1], None)
+                if segment is not None:
+                    segment.close()
+                continue
+            sequence, name, image, output, input_shape, mode, settings, scale, start, end, finish, data = task
+            try:
+                processor.update_settings(**settings)
+                plan = processor.plan(mode)
+                plan.scale = scale
+                if start == 0:
+                    frame = Frame(view(name, *image), plan)
+                else:
+                    # The input was overwritten by an earlier segment; a zero-stride stand-in keeps its shape
+                    frame = Frame(np.broadcast_to(np.uint8(0), input_shape), plan)
+                    frame.image = view(name, *image)
+                # Per-frame data (noise patterns) chosen by the parent, with arrays in shared memory
+                for index, value in data.items():
+                    frame.data[plan.stages[index]] = tuple(view(*item[1:]) if isinstance(item, tuple) else item
+                                                           for item in value)
+                plan.run_range(frame, start, end)
+                if finish:
+                    # The result goes back into the slot the frame came in
+                    np.copyto(view(name, *output), plan.finish(frame))
+                    shape = None
+                else:
+                    # Intermediate images wait at the start of the slot for the next segment
+                    shape = frame.image.shape
+                    np.copyto(view(name, 0, shape, None), frame.image)
+                del frame
+                results.put((sequence, None, shape))
+            except Exception:
+                results.put((sequence, traceback.format_exc(), None))
+    finally:
+        for segment in segments.values():
+            segment.close()
+
+def plan_segments(plan):
+    # (start, end, ordered) runs of stages. Ordered stages keep state from frame to frame and run in
+    # the parent in frame order; the rest run on any worker. With change detection the runs also
+    # split where the reusable prefix ends, so the parent can cache it.
+    count = len(plan.stages)
+    bounds = {0, count}
+    for index in range(1, count):
+        if plan.stages[index].ordered != plan.stages[index - 1].ordered:
+            bounds.add(index)
+    if plan.change_detector is not None and plan.static_end:
+        bounds.add(plan.static_end)
+    bounds = sorted(bounds)
+    segments = [(start, end, plan.stages[start].ordered) for start, end in zip(bounds, bounds[1:])]
+    if plan.change_detector is not None and plan.static_end == count:
+        # A frame reusing the whole chain still needs its output step
+        segments.append((count, count, False))
+    return segments
+
+def array_meta(array, base):
+    # (offset, shape, strides) of array inside the buffer that starts at base
+    return array.__array_interface__["data"][0] - base.__array_interface__["data"][0], array.shape, array.strides
+
+class FrameJob:
+    # One frame on its way through the segments of its plan
+    def __init__(self, sequence, slot, view, output, plan, frame, task):
+        self.sequence = sequence
+        self.slot = slot
+        self.view = view
+        # Where the worker writes the result, relative to the slot
+        self.output = output
+        self.plan = plan
+        self.frame = frame
+        # (mode, settings, scale) for the workers
+        self.task = task
+        self.segments = plan_segments(plan) if plan.stages else []
+        self.index = 0
+        # (offset, shape, strides) of the image the next segment reads; the input view at first
+        self.image = output
+        self.worker = None
+        self.ordered_done = 0
+        self.ordered_total = sum(1 for segment in self.segments if segment[2])
+        self.done = not self.segments
+        self.error = None
+
+def stop_workers(processes, tasks, *segment_lists):
+    # Runs on shutdown, on garbage collection and at interpreter exit, whichever comes first
+    for queue in tasks:
+        try:
+            queue.put(None)
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        process.join(timeout=1.0)
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout=1.0)
+    for segments in segment_lists:
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # A caller still holds a view; the memory goes away with it
+                pass
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        segments.clear()
+
+class SharedFramePipeline:
+    def __init__(self, workers=None, max_in_flight=None, options=None, start_method=None):
+        # options: VisionProcessor arguments for the worker processes
+        # Frames travel in shared memory slots; the queues only carry slot names and geometry.
+        # State carried from frame to frame (noise patterns, change detection, the phosphor trail)
+        # stays with the caller's processor in this process, so output matches serial processing.
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max(1, max_in_flight or self.workers * 2)
+        if start_method is None:
+            # Forked workers inherit modes and palettes registered at runtime
+            start_method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+        context = mp.get_context(start_method)
+        self.results = context.Queue()
+        self.tasks = [context.Queue() for _ in range(self.workers)]
+        self.processes = [context.Process(target=worker_loop, args=(dict(options or {}), queue, self.results),
+                                          name=f"frame-worker-{index}", daemon=True)
+                          for index, queue in enumerate(self.tasks)]
+        for process in self.processes:
+            process.start()
+        self.segments = []
+        self.slots = []
+        self.slot_size = 0
+        # Largest frame acquire() was asked for; slots are sized for it even while frames are crops
+        self.size_hint = 0
+        self.free_slots = deque()
+        self.acquired = None
+        self.held = None
+        # FrameJobs in submission order, and the ones a worker is busy with by sequence
+        self.pending = deque()
+        self.running = {}
+        # Copies of results collected early because the slots had to be replaced
+        self.backlog = deque()
+        self.load = [0] * self.workers
+        # Noise tiles copied to shared memory: id(tile) -> [segment, tile, last sequence using it]
+        self.exported = OrderedDict()
+        self.max_exported = 32
+        self.export_segments = []
+        # Evicted tiles, unlinked once no frame in flight uses them
+        self.retired = []
+        self.next_sequence = 0
+        self.finalizer = weakref.finalize(self, stop_workers, self.processes, self.tasks, self.segments,
+                                          self.export_segments)
+
+    def allocate(self, size):
+        # One slot per frame in flight, one held by the caller and one being filled
+        if self.segments:
+            for queue in self.tasks:
+                queue.put("reset")
+        self.slots = []
+        self.held = self.acquired = None
+        stop_workers([], [], self.segments)
+        for _ in range(self.max_in_flight + 2):
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            self.segments.append(segment)
+            self.slots.append(np.ndarray((size,), np.uint8, segment.buf))
+        self.slot_size = size
+        self.free_slots = deque(range(len(self.slots)))
+
+    def take_slot(self, size):
+        size = max(size, self.size_hint)
+        if size > self.slot_size:
+            # Frames grew; wait for the old slots to come back before replacing them
+            self.backlog.extend(self.drain())
+            self.allocate(size)
+        if not self.free_slots:
+            raise RuntimeError("No free frame slot; keep at most max_in_flight frames in flight")
+        return self.free_slots.popleft()
+
+    def acquire(self, shape):
+        # Slot array for the next frame, e.g. for the camera to read into; None before the first frame
+        size = int(np.prod(shape))
+        self.size_hint = max(self.size_hint, size)
+        if not self.slots or size > self.slot_size:
+            return None
+        if self.acquired is None:
+            self.acquired = self.take_slot(size)
+        return self.slots[self.acquired][:size].reshape(shape)
+
+    def submit(self, frame, mode, processor):
+        # processor: the caller's VisionProcessor; its plans keep the state between frames
+        if frame.dtype != np.uint8:
+            raise ValueError("Shared frame slots hold uint8 images")
+        slot = self.acquired
+        self.acquired = None
+        # Intermediate images are at most one BGR frame and are written to the start of the slot
+        size = max(frame.nbytes, frame.shape[0] * frame.shape[1] * 3)
+        if slot is None or size > self.slot_size:
+            if slot is not None:
+                self.free_slots.append(slot)
+            slot = self.take_slot(size)
+        base = self.slots[slot]
+        start = base.__array_interface__["data"][0]
+        low, high = byte_bounds(frame)
+        if start <= low and high <= start + base.nbytes:
+            # Already in the slot (a capture or a crop of one): nothing to copy
+            view = frame
+        else:
+            view = base[:frame.nbytes].reshape(frame.shape)
+            np.copyto(view, frame)
+
+        plan = processor.plan(mode)
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        job = FrameJob(sequence, slot, view, array_meta(view, base), plan, None,
+                       (mode, dict(processor.settings), plan.scale))
+        if plan.stages:
+            # Noise patterns and change detection follow submission order, as in serial processing
+            job.frame = plan.begin(view)
+        self.pending.append(job)
+        self.advance()
+
+    def warm_up(self, modes, shape, processor):
+        # Every worker runs the modes once on a blank frame with the processor's settings and scales;
+        # frames submitted meanwhile wait behind it
+        for queue in self.tasks:
+            queue.put(("warm", list(modes), tuple(shape), dict(processor.settings),
+                       dict(processor.processing_scales)))
+
+    def slot_image(self, job, shape):
+        return self.slots[job.slot][:int(np.prod(shape))].reshape(shape)
+
+    def share(self, value, sequence):
+        # Arrays in per-frame data are noise windows into a few large tiles; each tile is copied to
+        # shared memory once and the workers get its name and the window geometry
+        if not isinstance(value, np.ndarray) or value.dtype != np.uint8:
+            return value
+        base = value if value.base is None else value.base
+        if not isinstance(base, np.ndarray) or base.dtype != np.uint8 or not base.flags.c_contiguous:
+            return value
+        entry = self.exported.get(id(base))
+        if entry is None:
+            segment = shared_memory.SharedMemory(create=True, size=max(1, base.nbytes))
+            np.copyto(np.ndarray(base.shape, np.uint8, segment.buf), base)
+            self.export_segments.append(segment)
+            entry = self.exported[id(base)] = [segment, base, sequence]
+            while len(self.exported) > self.max_exported:
+                self.retired.append(self.exported.popitem(last=False)[1])
+        else:
+            self.exported.move_to_end(id(base))
+        entry[2] = sequence
+        return ("shared", entry[0].name) + array_meta(value, base)
+
+    def release_exports(self):
+        oldest = self.pending[0].sequence if self.pending else self.next_sequence
+        retired = []
+        for entry in self.retired:
+            segment, _, sequence = entry
+            if sequence >= oldest:
+                retired.append(entry)
+                continue
+            for queue in self.tasks:
+                queue.put(("release", segment.name))
+            self.export_segments.remove(segment)
+            stop_workers([], [], [segment])
+        self.retired = retired
+
+    def dispatch(self, job, start, end, finish):
+        worker = min(range(self.workers), key=self.load.__getitem__)
+        data = {}
+        for index in range(start, end):
+            value = job.frame.data.get(job.plan.stages[index])
+            if value is not None:
+                data[index] = tuple(self.share(item, job.sequence) for item in value)
+        mode, settings, scale = job.task
+        self.tasks[worker].put((job.sequence, self.segments[job.slot].name, job.image, job.output,
+                                job.view.shape, mode, settings, scale, start, end, finish, data))
+        self.load[worker] += 1
+        job.worker = worker
+        self.running[job.sequence] = job
+
+    def run_ordered(self, job, start, end, finish):
+        # Stages with state between frames run here, after every earlier frame's ordered stages
+        frame = job.frame
+        if start > 0:
+            frame.image = self.slot_image(job, job.image[1])
+        try:
+            job.plan.run_range(frame, start, end)
+            if finish:
+                np.copyto(job.view, job.plan.finish(frame))
+                job.done = True
+            else:
+                np.copyto(self.slot_image(job, frame.image.shape), frame.image)
+                job.image = (0, frame.image.shape, None)
+        except Exception:
+            job.error = traceback.format_exc()
+            job.done = True
+        job.ordered_done += 1
+
+    def advance(self):
+        # Start the next segment of every frame that can move on
+        blocked = False
+        for job in self.pending:
+            while not job.done and job.worker is None:
+                start, end, ordered = job.segments[job.index]
+                finish = job.index == len(job.segments) - 1
+                if ordered:
+                    if blocked:
+                        break
+                    job.index += 1
+                    self.run_ordered(job, start, end, finish)
+                    continue
+                reuse = job.frame.reuse
+                if reuse is not None and start < job.plan.static_end:
+                    if not reuse.ready.is_set():
+                        # The frame filling the cached prefix is still on its way
+                        break
+                    if reuse.image is None:
+                        job.frame.reuse = None
+                    else:
+                        image = reuse.image
+                        np.copyto(self.slot_image(job, image.shape), image)
+                        job.image = (0, image.shape, None)
+                        job.index = next(index for index, segment in enumerate(job.segments)
+                                         if segment[0] == job.plan.static_end)
+                        continue
+                self.dispatch(job, start, end, finish)
+            if job.error is None and job.ordered_done < job.ordered_total:
+                # Later frames wait for this one's ordered stages
+                blocked = True
+
+    def finished(self, sequence, error, shape):
+        job = self.running.pop(sequence)
+        self.load[job.worker] -= 1
+        job.worker = None
+        start, end, _ = job.segments[job.index]
+        job.index += 1
+        fill = job.frame.fill
+        if error is not None:
+            job.error = error
+            job.done = True
+            if fill is not None and not fill.ready.is_set():
+                # Frames waiting for this prefix process their own instead
+                fill.store(None)
+        elif shape is None:
+            job.done = True
+        else:
+            job.image = (0, shape, None)
+            if fill is not None and end == job.plan.static_end:
+                fill.store(self.slot_image(job, shape).copy())
+
+    @property
+    def in_flight(self):
+        return len(self.pending) + len(self.backlog)
+
+    def collect(self, timeout=None):
+        # Move finished segments off the queue and start the next ones; raises if a worker process died
+        try:
+            while True:
+                self.finished(*self.results.get(timeout=timeout))
+                timeout = 0
+        except Empty:
+            pass
+        self.advance()
+        for process in self.processes:
+            if not process.is_alive():
+                self.close()
+                raise RuntimeError(f"Frame worker {process.name} exited with code {process.exitcode}")
+
+    def ready(self):
+        if self.backlog:
+            return True
+        if not self.pending:
+            return False
+        if not self.pending[0].done:
+            self.collect(0)
+        return self.pending[0].done
+
+    def get(self):
+        # Results come back in submission order and stay valid until the next get
+        if self.held is not None:
+            self.free_slots.append(self.held)
+            self.held = None
+        if self.backlog:
+            return self.backlog.popleft()
+        if not self.pending:
+            return None
+        job = self.pending[0]
+        while not job.done:
+            self.collect(0.5)
+        self.pending.popleft()
+        self.release_exports()
+        if job.error is not None:
+            self.free_slots.append(job.slot)
+            raise RuntimeError(f"Frame worker failed:\n{job.error}")
+        self.held = job.slot
+        return job.view
+
+    def drain(self):
+        results = list(self.backlog)
+        self.backlog.clear()
+        while self.pending:
+            results.append(self.get().copy())
+        return results
+
+    def close(self):
+        self.pending.clear()
+        self.running.clear()
+        self.backlog.clear()
+        self.exported.clear()
+        self.retired = []
+        self.slots = []
+        self.free_slots.clear()
+        self.finalizer()
+
+    def shutdown(self):
+        try:
+            self.drain()
+        finally:
+            self.close()
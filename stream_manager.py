@@ -0,0 +1,261 @@
+import cv2
+import os
+import math
+import time
+import argparse
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from vision_modes import VisionProcessor
+from frame_pipeline import FramePipeline
+from camera_handler import CameraHandler
+from batch_processor import FrameSource, FrameSink
+from frame_clock import FrameClock
+
+def is_live(source):
+    # Device ids and network URLs are read on a capture thread, files on demand
+    return isinstance(source, int) or str(source).isdigit() or "://" in str(source)
+
+class Stream:
+    def __init__(self, name, source, mode="normal", fps_cap=None, sink=None,
+                 enable_noise=True, enable_vignette=True, seed=None, change_threshold=None):
+        self.name = name
+        self.source = source
+        self.mode = mode
+        self.fps_cap = fps_cap
+        self.sink = sink
+        self.camera = None
+        self.reader = None
+        # Files are read faster than they were shot, so their effects run on a per-frame clock
+        self.clock = None
+        self.frame_index = 0
+        if is_live(source):
+            self.camera = CameraHandler(int(source) if str(source).isdigit() else source, threaded=True)
+        else:
+            self.reader = FrameSource(source)
+            self.frames = iter(self.reader)
+            self.clock = FrameClock(self.reader.fps)
+        # Every stream has its own effect state (noise, phosphor trail)
+        self.processor = VisionProcessor(seed=seed, clock=self.clock)
+        self.processor.update_settings(enable_noise, enable_vignette)
+        self.processor.change_threshold = change_threshold
+        self.pipeline = None
+        self.limit = None  # Stop reading after this many frames
+        self.next_due = 0.0
+        self.finished = False
+        self.completed = 0
+        self.latest = None
+        self.frame_times = deque(maxlen=30)
+
+    def due(self, now):
+        return self.fps_cap is None or now >= self.next_due
+
+    def mark_submitted(self, now):
+        # Keep the capped cadence without bursting after a stall
+        if self.fps_cap:
+            interval = 1.0 / self.fps_cap
+            self.next_due = max(self.next_due, now - interval) + interval
+
+    def read(self):
+        # Next frame, or None when nothing is available yet or the source has ended
+        if self.limit is not None and self.completed + self.pipeline.in_flight >= self.limit:
+            self.finished = True
+            return None
+        if self.camera is not None:
+            buffer = self.camera.frame_buffer
+            if buffer.queue_depth == 0:
+                self.finished = buffer.closed
+                return None
+            frame = self.camera.get_frame()
+            # Ring buffer slots are reused by the capture thread
+            return None if frame is None else frame.copy()
+        try:
+            self.frame_index, frame = next(self.frames)
+        except StopIteration:
+            self.finished = True
+            return None
+        return frame
+
+    def stages(self):
+        # Pipeline stages for the frame read last
+        stages = self.processor.stages(self.mode)
+        if self.clock is None:
+            return stages
+        return self.clock.timed(stages, self.frame_index)
+
+    def deliver(self, frame):
+        self.latest = frame
+        self.frame_times.append(time.perf_counter())
+        if self.sink is not None:
+            self.sink.write(self.completed, frame)
+        self.completed += 1
+
+    @property
+    def measured_fps(self):
+        if len(self.frame_times) < 2:
+            return 0.0
+        span = self.frame_times[-1] - self.frame_times[0]
+        return (len(self.frame_times) - 1) / span if span > 0 else 0.0
+
+    def release(self):
+        if self.camera is not None:
+            self.camera.release()
+        if self.reader is not None:
+            self.reader.release()
+        if self.sink is not None:
+            self.sink.release()
+
+class Mosaic:
+    def __init__(self, count, tile_size=(640, 360), columns=None):
+        self.tile_width, self.tile_height = tile_size
+        self.columns = columns or max(1, math.ceil(math.sqrt(count)))
+        rows = max(1, math.ceil(count / self.columns))
+        self.canvas = np.zeros((rows * self.tile_height, self.columns * self.tile_width, 3), np.uint8)
+
+    def update(self, index, frame, label=None):
+        # Resize straight into the stream's tile of the preallocated canvas
+        x = (index % self.columns) * self.tile_width
+        y = (index // self.columns) * self.tile_height
+        tile = self.canvas[y:y + self.tile_height, x:x + self.tile_width]
+        cv2.resize(frame, (self.tile_width, self.tile_height), dst=tile, interpolation=cv2.INTER_AREA)
+        if label:
+            cv2.putText(tile, label, (8, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+
+class StreamManager:
+    def __init__(self, streams, workers=None, max_in_flight=None):
+        self.streams = list(streams)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="stream-worker")
+        # Equal in-flight share per stream so a fast source cannot starve the others
+        total = max_in_flight or self.workers * 2
+        per_stream = max(1, total // max(1, len(self.streams)))
+        for stream in self.streams:
+            stream.pipeline = FramePipeline(self.workers, per_stream, executor=self.executor)
+        self.turn = 0
+
+    def schedule(self, now):
+        # One round-robin pass starting at a rotating stream; each due stream submits at most one frame
+        submitted = 0
+        count = len(self.streams)
+        for offset in range(count):
+            stream = self.streams[(self.turn + offset) % count]
+            pipeline = stream.pipeline
+            if stream.finished or not stream.due(now) or pipeline.in_flight >= pipeline.max_in_flight:
+                continue
+            frame = stream.read()
+            if frame is None:
+                continue
+            pipeline.submit(frame, stream.stages())
+            stream.mark_submitted(now)
+            submitted += 1
+        self.turn = (self.turn + 1) % max(1, count)
+        return submitted
+
+    def collect(self):
+        # Finished frames go to their streams in capture order
+        delivered = []
+        for stream in self.streams:
+            while stream.pipeline.ready():
+                stream.deliver(stream.pipeline.get())
+                delivered.append(stream)
+        return delivered
+
+    @property
+    def active(self):
+        return any(not stream.finished or stream.pipeline.in_flight for stream in self.streams)
+
+    def run(self, mosaic=None, mosaic_sink=None, display=False, max_frames=None):
+        window = "Advanced Vision System - Streams"
+        for stream in self.streams:
+            stream.limit = max_frames
+        try:
+            while self.active:
+                submitted = self.schedule(time.perf_counter())
+                delivered = self.collect()
+
+                if delivered and mosaic is not None:
+                    for stream in set(delivered):
+                        index = self.streams.index(stream)
+                        mosaic.update(index, stream.latest,
+                                      f"{stream.name} {stream.mode} {stream.measured_fps:.0f} fps")
+                    if mosaic_sink is not None:
+                        mosaic_sink.write(mosaic_sink.frames_written, mosaic.canvas)
+                    if display:
+                        cv2.imshow(window, mosaic.canvas)
+                        if cv2.waitKey(1) & 0xFF == ord('q'):
+                            break
+
+                if not submitted and not delivered:
+                    # Nothing to do until a worker or capture thread finishes
+                    time.sleep(0.001)
+        finally:
+            self.close()
+
+    def close(self):
+        for stream in self.streams:
+            for frame in stream.pipeline.drain():
+                stream.deliver(frame)
+            stream.pipeline.shutdown()
+            stream.release()
+        self.executor.shutdown(wait=True)
+
+def parse_stream(values, index, output_dir=None, enable_noise=True, enable_vignette=True,
+                 change_threshold=None):
+    # SOURCE [MODE [FPS]]
+    if not 1 <= len(values) <= 3:
+        raise ValueError(f"--stream expects SOURCE [MODE [FPS]], got {values}")
+    source = values[0]
+    mode = values[1] if len(values) > 1 else "normal"
+    fps_cap = float(values[2]) if len(values) > 2 else None
+    sink = None
+    if output_dir:
+        sink = FrameSink(os.path.join(output_dir, f"stream_{index}.mp4"), fps_cap or 30.0)
+    return Stream(f"#{index}", source, mode, fps_cap, sink, enable_noise, enable_vignette,
+                  change_threshold=change_threshold)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Process several cameras or files on one worker pool")
+    parser.add_argument("--stream", nargs="+", action="append", required=True, metavar="ARG",
+                        help="SOURCE [MODE [FPS]]: camera id, video file or URL, vision mode and FPS cap")
+    parser.add_argument("--workers", type=int, default=None, help="shared worker threads")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="frames processed concurrently across all streams")
+    parser.add_argument("--display", action="store_true", help="show a mosaic of all streams")
+    parser.add_argument("--mosaic-output", help="write the mosaic to this video file")
+    parser.add_argument("--tile-size", type=int, nargs=2, default=[640, 360], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--output-dir", help="write every stream to its own video file in this directory")
+    parser.add_argument("--max-frames", type=int, default=None, help="stop after this many frames per stream")
+    parser.add_argument("--no-noise", action="store_true", help="disable noise")
+    parser.add_argument("--no-vignette", action="store_true", help="disable vignette")
+    parser.add_argument("--change-threshold", type=float, default=None,
+                        help="reuse the static effect stages of idle streams (gray levels per block); "
+                             "thermal streams then add their noise after the bloom")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    streams = [parse_stream(values, index, args.output_dir, not args.no_noise, not args.no_vignette,
+                            args.change_threshold)
+               for index, values in enumerate(args.stream)]
+    manager = StreamManager(streams, args.workers, args.max_in_flight)
+
+    mosaic = None
+    mosaic_sink = None
+    if args.display or args.mosaic_output:
+        mosaic = Mosaic(len(streams), tuple(args.tile_size))
+    if args.mosaic_output:
+        mosaic_sink = FrameSink(args.mosaic_output)
+    try:
+        manager.run(mosaic, mosaic_sink, args.display, args.max_frames)
+    finally:
+        if mosaic_sink is not None:
+            mosaic_sink.release()
+        if args.display:
+            cv2.destroyAllWindows()
+    for stream in streams:
+        print(f"{stream.name} {stream.source}: {stream.completed} frames ({stream.mode})")
+        for line in stream.processor.change_summary():
+            print(f"  change detection {line}")
+
+if __name__ == "__main__":
+    main()
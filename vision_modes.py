@@ -1,166 +1,223 @@
-import cv2
-import numpy as np
-from time import time
-
-class NightVision:
-    def __init__(self):
-        self.brightness_levels = {
-            "high": 2.5,
-            "low": 1.8,
-            "green": 2.0,
-            "blue": 2.0
-        }
-        self.noise_pattern = None
-        self.last_noise_update = 0
-        self.noise_update_interval = 0.03
-
-    def create_dynamic_noise(self, shape):
-        # Create dynamic noise with varying intensity
-        base_noise = np.random.normal(0, 15, shape).astype(np.uint8)
-        noise_intensity = np.random.uniform(0.7, 1.3)  # Random intensity multiplier
-        return cv2.multiply(base_noise, noise_intensity)
-    
-    def add_tube_distortion(self, frame):
-        height, width = frame.shape[:2]
-        center_x, center_y = width // 2, height // 2
-        
-        # Create radial gradient
-        Y, X = np.ogrid[:height, :width]
-        dist_from_center = np.sqrt((X - center_x)**2 + (Y - center_y)**2)
-        
-        # Create vignette effect
-        vignette = 1 - (dist_from_center / (np.sqrt(center_x**2 + center_y**2)))
-        vignette = np.clip(vignette * 1.5, 0, 1)
-        
-        # Apply vignette
-        frame = frame * vignette[:, :, np.newaxis]
-        return frame.astype(np.uint8)
-    
-    def process(self, frame, brightness_level="high"):
-        # Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Apply CLAHE for better contrast
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-        enhanced = clahe.apply(gray)
-        
-        # Update noise pattern periodically
-        current_time = time()
-        if current_time - self.last_noise_update > self.noise_update_interval:
-            self.noise_pattern = self.create_dynamic_noise(enhanced.shape)
-            self.last_noise_update = current_time
-        
-        # Add dynamic noise
-        if self.noise_pattern is not None:
-            enhanced = cv2.add(enhanced, self.noise_pattern)
-        
-        # Apply brightness adjustment
-        multiplier = self.brightness_levels.get(brightness_level, 1.8)
-        enhanced = cv2.multiply(enhanced, multiplier)
-        
-        # Create tint based on mode
-        zeros = np.zeros_like(enhanced)
-        if brightness_level == "blue":
-            tinted = cv2.merge([enhanced, zeros, zeros])  # Blue tint
-        elif brightness_level == "green":
-            tinted = cv2.merge([zeros, enhanced, zeros])  # Green tint
-        else:
-            tinted = cv2.merge([zeros, enhanced, zeros])  # Default green
-        
-        # Add phosphor trailing effect
-        if hasattr(self, 'previous_frame'):
-            tinted = cv2.addWeighted(tinted, 0.85, self.previous_frame, 0.15, 0)
-        self.previous_frame = tinted.copy()
-        
-        # Add tube distortion and vignette
-        tinted = self.add_tube_distortion(tinted)
-        
-        # Add light bloom effect
-        blur = cv2.GaussianBlur(tinted, (0, 0), 5)
-        tinted = cv2.addWeighted(tinted, 0.8, blur, 0.2, 0)
-        
-        # Add scan lines
-        height = tinted.shape[0]
-        scan_lines = np.zeros_like(tinted)
-        scan_lines[::2, :] = [0, 20, 0]
-        tinted = cv2.subtract(tinted, scan_lines)
-        
-        return tinted
-
-class ThermalVision:
-    def __init__(self):
-        self.colormap_modes = {
-            "hot_white": cv2.COLORMAP_HOT,
-            "hot_black": cv2.COLORMAP_BONE,
-            "rainbow": cv2.COLORMAP_RAINBOW,
-            "ironbow": cv2.COLORMAP_INFERNO,
-            "plasma": cv2.COLORMAP_PLASMA
-        }
-        self.noise_pattern = None
-        self.last_noise_update = 0
-        self.noise_update_interval = 0.05
-        self.enable_noise = True
-        self.enable_vignette = True
-        
-    def create_thermal_noise(self, shape):
-        noise = np.random.normal(0, 2, shape).astype(np.uint8)
-        return cv2.GaussianBlur(noise, (3, 3), 0)
-    
-    def apply_circular_mask(self, frame):
-        height, width = frame.shape[:2]
-        center_x, center_y = width // 2, height // 2
-        radius = min(center_x, center_y) - 10
-        
-        # Create circular mask
-        Y, X = np.ogrid[:height, :width]
-        dist_from_center = np.sqrt((X - center_x)**2 + (Y - center_y)**2)
-        mask = dist_from_center <= radius
-        
-        # Create gradual fade at edges
-        fade_width = 30
-        fade_mask = (dist_from_center <= (radius + fade_width)) & (dist_from_center > radius)
-        fade_values = 1 - (dist_from_center[fade_mask] - radius) / fade_width
-        
-        # Apply masks
-        result = np.zeros_like(frame)
-        result[mask] = frame[mask]
-        result[fade_mask] = (frame[fade_mask].T * fade_values).T
-        
-        return result
-    
-    def process(self, frame, mode="hot_white"):
-        # Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Add thermal noise if enabled
-        if self.enable_noise:
-            current_time = time()
-            if current_time - self.last_noise_update > self.noise_update_interval:
-                self.noise_pattern = self.create_thermal_noise(gray.shape)
-                self.last_noise_update = current_time
-            
-            if self.noise_pattern is not None:
-                gray = cv2.add(gray, self.noise_pattern)
-        
-        # Apply blur and enhance contrast
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        clahe = cv2.createCLAHE(clipLimit=4.0, tileGridSize=(8,8))
-        enhanced = clahe.apply(blurred)
-        
-        # Apply thermal colormap
-        colormap = self.colormap_modes.get(mode, cv2.COLORMAP_HOT)
-        thermal = cv2.applyColorMap(enhanced, colormap)
-        
-        # Add heat signature effect
-        kernel = np.ones((3,3), np.uint8)
-        thermal = cv2.dilate(thermal, kernel, iterations=1)
-        
-        # Add heat bloom effect
-        heat_blur = cv2.GaussianBlur(thermal, (0, 0), 10)
-        thermal = cv2.addWeighted(thermal, 0.7, heat_blur, 0.3, 0)
-        
-        # Apply circular mask if vignette is enabled
-        if self.enable_vignette:
-            thermal = self.apply_circular_mask(thermal)
-        
-        return thermal 
\ No newline at end of file
+import cv2
+import numpy as np
+from mask_cache import MaskCache, shared_mask_cache
+from contrast import ContrastEnhancer
+from noise_bank import NoiseBank
+from change_detector import ChangeDetector
+from profiler import profiler
+from effect_graph import (Grayscale, Contrast, Noise, Brightness, PhosphorTrail, Vignette, Bloom,
+                          ScanLines, Tint, Blur, Colormap, Dilate, CircularMask,
+                          register_mode, mode_names, mode_prefix, compile_mode)
+
+class NightVision:
+    def __init__(self, seed=None, clock=None, mask_cache=None):
+        self.brightness_levels = {
+            "high": 2.5,
+            "low": 1.8,
+            "green": 2.0,
+            "blue": 2.0
+        }
+        self.vignette_strength = 1.5
+        self.mask_cache = mask_cache or shared_mask_cache
+        self.contrast = ContrastEnhancer(clip_limit=3.0, tile_grid=(8, 8))
+        # Noise refresh and phosphor trail are shared by all brightness levels
+        self.noise = Noise(NoiseBank(sigma=15, intensity=(0.7, 1.3), seed=seed), 0.03, clock)
+        self.trail = PhosphorTrail(0.85, 0.15)
+        self.bloom_method = "pyramid"
+
+    def pipeline(self, brightness_level="high"):
+        # The whole chain runs on one luminance plane that is tinted at the end
+        multiplier = self.brightness_levels.get(brightness_level, 1.8)
+        stages = [
+            Grayscale(),
+            Contrast(self.contrast),
+            self.noise,
+            Brightness(multiplier),
+            self.trail,
+            Vignette(self.vignette_strength, self.mask_cache),
+            Bloom(5, 0.8, 0.2, self.bloom_method)
+        ]
+        # Scan lines only darken the green channel, so the blue tint has none
+        if brightness_level == "blue":
+            return stages + [Tint(0)]
+        return stages + [ScanLines(20), Tint(1)]
+
+class ThermalVision:
+    def __init__(self, seed=None, clock=None, mask_cache=None):
+        self.colormap_modes = {
+            "hot_white": cv2.COLORMAP_HOT,
+            "hot_black": cv2.COLORMAP_BONE,
+            "rainbow": cv2.COLORMAP_RAINBOW,
+            "ironbow": cv2.COLORMAP_INFERNO,
+            "plasma": cv2.COLORMAP_PLASMA
+        }
+        self.mask_margin = 10
+        self.fade_width = 30
+        self.mask_cache = mask_cache or shared_mask_cache
+        self.contrast = ContrastEnhancer(clip_limit=4.0, tile_grid=(8, 8))
+        # Tiles are blurred once when the bank is built
+        self.noise = Noise(NoiseBank(sigma=2, blur=(3, 3), seed=seed), 0.05, clock)
+        # With change detection the noise goes on just before the palette lookup instead, so unchanged
+        # frames reuse blur, contrast and bloom. Blur and CLAHE no longer shape it, so the tiles are
+        # stronger to give about the same grain (std 1.8 levels at the lookup)
+        self.late_noise = Noise(NoiseBank(sigma=5, blur=(3, 3), seed=seed), 0.05, clock)
+        self.bloom_method = "pyramid"
+        # All tone work stays on the luminance plane and the palette lookup absorbs the circular fade;
+        # False dilates and blooms the colormapped image instead (slower, softer hue transitions)
+        self.luminance_bloom = True
+        # Multi-hue palettes shift hue visibly when bloomed before the lookup, so they keep the color bloom
+        self.color_bloom_palettes = {"rainbow"}
+        # True equalizes only the square around the visible circle while the vignette is on. Faster,
+        # but the CLAHE tile grid then covers the square instead of the frame, which changes the output
+        self.crop_contrast = False
+
+    def pipeline(self, mode="hot_white", late_noise=False):
+        circle = (self.mask_margin, self.fade_width) if self.crop_contrast else None
+        colormap = [Colormap(self.colormap_modes.get(mode, cv2.COLORMAP_HOT), custom_palettes.get(mode))]
+        if late_noise:
+            colormap = [self.late_noise] + colormap
+        heat = [Dilate(3), Bloom(10, 0.7, 0.3, self.bloom_method)]
+        if self.luminance_bloom and mode not in self.color_bloom_palettes:
+            heat = heat + colormap
+        else:
+            heat = colormap + heat
+        tone = [Grayscale(), Blur(5), Contrast(self.contrast, circle)]
+        if not late_noise:
+            tone.insert(1, self.noise)
+        return tone + heat + [CircularMask(self.mask_margin, self.fade_width, self.mask_cache)]
+
+def night_mode(level):
+    return lambda processor: processor.night_vision.pipeline(level)
+
+def thermal_mode(palette):
+    return lambda processor: processor.thermal_vision.pipeline(palette, processor.change_threshold is not None)
+
+# User palettes by name as 256x1 BGR tables, looked up before the built-in colormaps
+custom_palettes = {}
+
+def palette_table(colors):
+    # Evenly spaced BGR stops from coldest to hottest, interpolated to 256 entries
+    colors = np.asarray(colors, np.float32).reshape(-1, 3)
+    positions = np.linspace(0, 255, len(colors))
+    table = np.stack([np.interp(np.arange(256), positions, colors[:, channel]) for channel in range(3)], axis=1)
+    return np.round(table).astype(np.uint8).reshape(256, 1, 3)
+
+def register_palette(name, colors):
+    # colors: BGR stops or a ready 256x1x3 uint8 table; adds a thermal_<name> mode to the cycle
+    table = np.asarray(colors)
+    if table.shape != (256, 1, 3) or table.dtype != np.uint8:
+        table = palette_table(colors)
+    custom_palettes[name] = table
+    register_mode("thermal_" + name, thermal_mode(name), "thermal")
+
+def parse_palette(value):
+    # "arctic=000000,0044ff,ffffff" -> ("arctic", BGR stops) from RGB hex colors
+    name, _, stops = value.partition("=")
+    if not stops:
+        raise ValueError(f"Expected NAME=RRGGBB,RRGGBB,..., got {value!r}")
+    colors = []
+    for stop in stops.split(","):
+        rgb = int(stop.strip().lstrip("#"), 16)
+        colors.append((rgb & 0xFF, (rgb >> 8) & 0xFF, rgb >> 16))
+    return name, colors
+
+# Built-in modes in the order the GUI cycles through them
+for level in ["high", "low"]:
+    register_mode("night_" + level, night_mode(level), "night")
+for palette in ["hot_white", "hot_black", "rainbow", "ironbow", "plasma"]:
+    register_mode("thermal_" + palette, thermal_mode(palette), "thermal")
+for level in ["green", "blue"]:
+    register_mode("night_" + level, night_mode(level), "night")
+
+class VisionProcessor:
+    def __init__(self, seed=None, bloom_method="pyramid", luminance_bloom=True,
+                 change_threshold=None, clock=None, crop_contrast=False):
+        # Masks are cached per processor, so processors at other resolutions (several streams)
+        # never evict each other's; two resolutions cover full and reduced processing scale
+        self.mask_cache = MaskCache(max_resolutions=2)
+        # A fixed seed and a clock that advances per frame (see replay.py) make the output repeatable
+        self.night_vision = NightVision(seed, clock, self.mask_cache)
+        self.thermal_vision = ThermalVision(None if seed is None else seed + 1, clock, self.mask_cache)
+        self.night_vision.bloom_method = bloom_method
+        self.thermal_vision.bloom_method = bloom_method
+        self.thermal_vision.luminance_bloom = luminance_bloom
+        self.thermal_vision.crop_contrast = crop_contrast
+        self.settings = {"enable_noise": True, "enable_vignette": True}
+        self.plans = {}
+        # Internal processing scale by mode name or prefix ("thermal", "night"); full size otherwise
+        self.processing_scales = {}
+        # Optional AdaptiveScale that shrinks every mode further when frames run over budget
+        self.auto_scale = None
+        # Block brightness change below which a frame reuses the static part of the chain; None disables it
+        self.change_threshold = change_threshold
+
+    def update_settings(self, enable_noise=True, enable_vignette=True):
+        self.settings = {"enable_noise": enable_noise, "enable_vignette": enable_vignette}
+
+    def modes(self):
+        return mode_names()
+
+    def processing_scale(self, mode):
+        scale = self.processing_scales.get(mode, self.processing_scales.get(mode_prefix(mode), 1.0))
+        if self.auto_scale is not None:
+            scale *= self.auto_scale.factor
+        return min(scale, 1.0)
+
+    def plan(self, mode):
+        # Each mode is compiled once per combination of settings; the scale can change per frame
+        key = (mode, tuple(sorted(self.settings.items())))
+        plan = self.plans.get(key)
+        if plan is None:
+            plan = self.plans[key] = compile_mode(mode, self, self.settings)
+            if self.change_threshold is not None:
+                plan.set_change_detector(ChangeDetector(self.change_threshold))
+        plan.scale = self.processing_scale(mode)
+        return plan
+
+    def change_summary(self):
+        # Share of frames that reused the static stages, per mode used with change detection
+        lines = []
+        for (mode, settings), plan in self.plans.items():
+            detector = plan.change_detector
+            if detector is None or not detector.frames:
+                continue
+            disabled = "".join(f", {name[len('enable_'):]} off" for name, value in settings if not value)
+            reused = "+".join(stage.name for stage in plan.stages[:plan.static_end]) or "nothing"
+            lines.append(f"{mode}{disabled}: {detector.reuse_ratio:.0%} of {detector.frames} frames reused {reused}")
+        return lines
+
+    def stages(self, mode):
+        return self.plan(mode).pipeline
+
+    def warm_up(self, modes, shape):
+        # Runs one blank frame of shape through each mode on the calling thread, so the plan, masks,
+        # noise tiles, contrast tables and this thread's buffers exist before the first real frame.
+        # Trails, noise patterns and draws, and change references are restored afterwards, so the
+        # following frames come out exactly as they would without the warm-up
+        blank = np.full(shape, 128, np.uint8)
+        # Cold timings would skew the profiler's rolling statistics
+        enabled = profiler.enabled
+        profiler.enabled = False
+        try:
+            for mode in modes:
+                plan = self.plan(mode)
+                state = plan.save()
+                try:
+                    plan.run(blank)
+                finally:
+                    plan.restore(state)
+        finally:
+            profiler.enabled = enabled
+
+    def process(self, frame, mode):
+        return self.plan(mode).run(frame)
+
+def parse_processing_scales(values):
+    # ["thermal=0.5", "night_blue=0.75"] -> {"thermal": 0.5, "night_blue": 0.75}
+    scales = {}
+    for value in values or []:
+        name, _, scale = value.partition("=")
+        if not scale:
+            raise ValueError(f"Expected MODE=SCALE, got {value!r}")
+        scales[name] = float(scale)
+    return scales